@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import add_scan_noise, random_wz_number, render_wz_header
+from core import cfg
+from core.cache import cache
+from core.fallback import EasyOcrFallback
+from core.models import models
+from core.reader import PdfImage, find_number
+
+
+def generate(args: argparse.Namespace) -> None:
+    # Noisy WZ pages, the kind Tesseract gives up on.
+    rng = np.random.default_rng(args.seed)
+    os.makedirs(args.output, exist_ok=True)
+    truth = {}
+    for i in range(args.pages):
+        number = random_wz_number(rng)
+        page = add_scan_noise(render_wz_header(number, rng), rng)
+        file_name = f"page-{i:04d}.png"
+        page.save(os.path.join(args.output, file_name))
+        truth[file_name] = number
+
+    with open(os.path.join(args.output, "truth.json"), "w") as f:
+        json.dump(truth, f, indent=2)
+    print(f"Wrote {args.pages} pages to {args.output}.")
+
+
+def load_headers(directory: str) -> tuple[list[PdfImage], list[str]]:
+    with open(os.path.join(directory, "truth.json")) as f:
+        truth = json.load(f)
+
+    headers, expected = [], []
+    for file_name, number in sorted(truth.items()):
+        with Image.open(os.path.join(directory, file_name)) as img:
+            header = PdfImage(img.convert("RGB"))
+        header.cut()
+        headers.append(header)
+        expected.append(number)
+    return headers, expected
+
+
+def measure_page(headers: list[PdfImage]) -> tuple[list, float, int]:
+    started = time.perf_counter()
+    numbers = [find_number(header.get_easyocr_content()) for header in headers]
+    return numbers, time.perf_counter() - started, len(headers)
+
+
+def measure_batch(
+    headers: list[PdfImage], fallback: EasyOcrFallback, full_fallback: bool
+) -> tuple[list, float, int]:
+    started = time.perf_counter()
+    numbers = fallback.run([header._image for header in headers], find_number)
+    full_calls = 0
+    if full_fallback:
+        for i, header in enumerate(headers):
+            if numbers[i] is None:
+                full_calls += 1
+                numbers[i] = find_number(header.get_easyocr_content())
+    return numbers, time.perf_counter() - started, full_calls
+
+
+def run(args: argparse.Namespace) -> None:
+    cache.enabled = False
+    headers, expected = load_headers(args.path)
+    if not headers:
+        raise ValueError(f"No pages found in {args.path}.")
+
+    models.reader
+    fallback = EasyOcrFallback(args.canvas_size, args.batch_size)
+    results = {
+        "page": measure_page(headers),
+        "batch": measure_batch(headers, fallback, args.full_fallback),
+    }
+
+    for mode, (numbers, seconds, full_calls) in results.items():
+        correct = sum(number == truth for number, truth in zip(numbers, expected))
+        wrong = sum(
+            number is not None and number != truth
+            for number, truth in zip(numbers, expected)
+        )
+        print(
+            f"{mode:>5}: {len(headers) / seconds:.2f} pages/s, "
+            f"accuracy {correct / len(headers):.3f}, {wrong} wrong numbers, "
+            f"{full_calls} full-header readtext calls"
+        )
+
+    speedup = results["page"][1] / results["batch"][1]
+    print(f"Batched fallback is {speedup:.2f}x the per-page throughput.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the per-page and the batched EasyOCR fallback."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser(
+        "generate", help="Write a corpus of noisy WZ pages with a truth.json."
+    )
+    generate_parser.add_argument("output", type=str)
+    generate_parser.add_argument("--pages", type=int, default=50)
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.set_defaults(handler=generate)
+
+    run_parser = commands.add_parser(
+        "run", help="OCR the page headers of a corpus with both fallbacks."
+    )
+    run_parser.add_argument("path", type=str, help="Directory with truth.json.")
+    run_parser.add_argument(
+        "--canvas-size", type=int, default=cfg.EASYOCR_DETECT_CANVAS
+    )
+    run_parser.add_argument("--batch-size", type=int, default=cfg.EASYOCR_BATCH_SIZE)
+    run_parser.add_argument(
+        "--no-full-fallback",
+        dest="full_fallback",
+        action="store_false",
+        default=cfg.EASYOCR_FULL_FALLBACK,
+        help="Do not read the whole header when no WZ line was found.",
+    )
+    run_parser.set_defaults(handler=run)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import time
+
+from PIL import Image
+
+from core import cfg
+from core.cache import cache
+from core.reader import PdfImage
+
+LABELS = {"empty": True, "content": False}
+
+
+def load_pages(directory: str) -> list[tuple[str, bool, PdfImage]]:
+    pages = []
+
+    for label, is_empty in LABELS.items():
+        label_dir = os.path.join(directory, label)
+        for file_name in sorted(os.listdir(label_dir)):
+            if file_name.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff")):
+                with Image.open(os.path.join(label_dir, file_name)) as img:
+                    page = PdfImage(img.convert("RGB"))
+                pages.append((file_name, is_empty, page))
+
+    return pages
+
+
+def measure(pages: list[tuple[str, bool, PdfImage]], method: str) -> dict:
+    cfg.EMPTY_PAGE_METHOD = method
+    correct = fallbacks = 0
+    predictions = []
+    started = time.perf_counter()
+
+    for _, is_empty, page in pages:
+        if method == "ink":
+            density = page.ink_density()
+            fallbacks += cfg.EMPTY_INK_LOW < density < cfg.EMPTY_INK_HIGH
+
+        prediction = page.is_page_empty()
+        predictions.append(prediction)
+        correct += prediction == is_empty
+
+    elapsed = time.perf_counter() - started
+    return {
+        "method": method,
+        "accuracy": correct / len(pages),
+        "ms_per_page": elapsed * 1000 / len(pages),
+        "ocr_fallbacks": fallbacks if method == "ink" else len(pages),
+        "predictions": predictions,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the pixel-based empty page check with full-page OCR."
+    )
+    parser.add_argument(
+        "path",
+        type=str,
+        help="Directory with 'empty' and 'content' subdirectories of page images.",
+    )
+    args = parser.parse_args()
+
+    cache.enabled = False
+    pages = load_pages(args.path)
+    if not pages:
+        raise ValueError(f"No labelled pages found in {args.path}.")
+
+    ocr = measure(pages, "ocr")
+    ink = measure(pages, "ink")
+
+    for result in (ocr, ink):
+        print(
+            f"{result['method']:>4}: accuracy {result['accuracy']:.3f}, "
+            f"{result['ms_per_page']:.1f} ms/page, "
+            f"{result['ocr_fallbacks']} OCR calls"
+        )
+
+    agreement = sum(
+        a == b for a, b in zip(ocr["predictions"], ink["predictions"])
+    ) / len(pages)
+    print(f"Agreement with OCR: {agreement:.3f} ({len(pages)} pages)")
+    print(f"Speed-up: {ocr['ms_per_page'] / ink['ms_per_page']:.1f}x")
+
+    for (file_name, is_empty, _), prediction in zip(pages, ink["predictions"]):
+        if prediction != is_empty:
+            print(
+                f"Misclassified: {file_name} (labelled {'empty' if is_empty else 'content'})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from core import cfg
+from core.cache import cache
+from core.handlers import FileHandler
+from core.metrics import metrics
+from core.models import models
+from core.reader import PdfFileProcessor
+from core.stores import isolate
+
+HIGHER_IS_BETTER = {"pages_per_second", "accuracy"}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def page_accuracy(groups: dict[str, list[int]], truth: dict) -> float:
+    expected = {
+        page: number for number, pages in truth["groups"].items() for page in pages
+    }
+    produced = {page: number for number, pages in groups.items() for page in pages}
+    pages = set(expected) | set(produced)
+    if not pages:
+        return 1.0
+    return sum(expected.get(page) == produced.get(page) for page in pages) / len(pages)
+
+
+def run(args: argparse.Namespace) -> None:
+    cache.enabled = args.cache
+    truth_path = os.path.join(args.path, "truth.json")
+    truth = {}
+    if os.path.exists(truth_path):
+        with open(truth_path) as f:
+            truth = json.load(f)
+
+    started = time.perf_counter()
+    models.load()
+    models.warm_up()
+    startup = time.perf_counter() - started
+
+    options = {
+        "page_window": args.page_window,
+        "ocr_workers": args.ocr_workers,
+        "output_mode": args.output_mode,
+        "classify_dpi": args.classify_dpi,
+    }
+    files = []
+    metrics.reset()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        isolate(os.path.join(work_dir, "stores"))
+        for source in sorted(FileHandler.loop_files(args.path)):
+            file_name = os.path.basename(source)
+            file_path = shutil.copy(source, os.path.join(work_dir, file_name))
+
+            started = time.perf_counter()
+            processor = PdfFileProcessor(
+                file_path, output_dir=os.path.join(work_dir, "output"), **options
+            )
+            processor.process_pdf()
+            processor.save_all()
+            seconds = time.perf_counter() - started
+
+            summary = {
+                "file": file_name,
+                "pages": processor.pages_count,
+                "wz_count": processor.wz_count,
+                "seconds": seconds,
+            }
+            if file_name in truth:
+                summary["accuracy"] = page_accuracy(processor.groups, truth[file_name])
+            files.append(summary)
+
+    if not files:
+        raise ValueError(f"No PDF files found in {args.path}.")
+
+    pages = sum(summary["pages"] for summary in files)
+    seconds = sum(summary["seconds"] for summary in files)
+    scored = [summary["accuracy"] for summary in files if "accuracy" in summary]
+    result = {
+        "label": args.label or datetime.now().isoformat(timespec="seconds"),
+        "options": {**options, "cache": args.cache, "dpi": cfg.RASTER_DPI},
+        "startup_seconds": startup,
+        "pages": pages,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "accuracy": sum(scored) / len(scored) if scored else None,
+        "stages": metrics.stage_stats(),
+        "files": files,
+    }
+
+    print_result(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved results to {args.output}.")
+
+
+def print_result(result: dict) -> None:
+    print(
+        f"{result['label']}: {result['pages']} pages in {result['seconds']:.1f}s "
+        f"({result['pages_per_second']:.2f} pages/s), "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+    if result["accuracy"] is not None:
+        print(f"Page accuracy: {result['accuracy']:.3f}")
+
+    for name, stats in result["stages"].items():
+        print(
+            f"  {name:<12} n={stats['count']:<6} p50={stats['p50_ms']:9.1f}ms "
+            f"p90={stats['p90_ms']:9.1f}ms p99={stats['p99_ms']:9.1f}ms"
+        )
+
+
+def comparable_values(result: dict) -> dict[str, float]:
+    values = {
+        "pages_per_second": result["pages_per_second"],
+        "peak_rss_mb": result["peak_rss_mb"],
+    }
+    if result.get("accuracy") is not None:
+        values["accuracy"] = result["accuracy"]
+    for name, stats in result["stages"].items():
+        values[f"{name}.p50_ms"] = stats["p50_ms"]
+        values[f"{name}.p90_ms"] = stats["p90_ms"]
+    return values
+
+
+def compare(args: argparse.Namespace) -> None:
+    with open(args.baseline) as f:
+        baseline = comparable_values(json.load(f))
+    with open(args.candidate) as f:
+        candidate = comparable_values(json.load(f))
+
+    regressions = []
+    for name in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[name], candidate[name]
+        change = (after - before) / before if before else 0.0
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > args.tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<28} {before:12.2f} -> {after:12.2f} ({change:+.1%}){flag}")
+
+    if regressions:
+        print(
+            f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}."
+        )
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure PdfFileProcessor throughput and compare runs."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Process a directory of PDF files.")
+    run_parser.add_argument("path", type=str, help="Directory with PDF files.")
+    run_parser.add_argument("--output", type=str, help="Path of the JSON results.")
+    run_parser.add_argument("--label", type=str, help="Name of this run.")
+    run_parser.add_argument(
+        "--cache", action="store_true", help="Use an OCR cache, empty at the start."
+    )
+    run_parser.add_argument("--page-window", type=int)
+    run_parser.add_argument("--ocr-workers", type=int)
+    run_parser.add_argument("--output-mode", choices=["raster", "copy"])
+    run_parser.add_argument("--classify-dpi", type=int)
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("candidate", type=str)
+    compare_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Relative change treated as a regression.",
+    )
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from core.ml.parser import ImageParser
+
+DPI = 200
+PAGE_SIZE = (1654, 2339)
+SUPPLIERS = ["ABC", "KRT", "MAG", "POL", "WRO"]
+WORDS = [
+    "Towar",
+    "Ilosc",
+    "Cena",
+    "Wartosc",
+    "Paleta",
+    "Karton",
+    "Magazyn",
+    "Odbiorca",
+    "Dostawca",
+    "Netto",
+    "Brutto",
+    "Sztuk",
+    "Indeks",
+    "Partia",
+]
+
+
+def font(size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def random_wz_number(rng: np.random.Generator) -> str:
+    return (
+        f"WZ-{rng.integers(1, 9999)}/{rng.integers(1, 13):02d}/"
+        f"{rng.choice(SUPPLIERS)}/{rng.integers(2020, 2027)}"
+    )
+
+
+def draw_rows(draw: ImageDraw.ImageDraw, rng: np.random.Generator, top: int) -> None:
+    body = font(28)
+    for y in range(top, PAGE_SIZE[1] - 200, 60):
+        words = " ".join(rng.choice(WORDS, size=rng.integers(3, 8)))
+        draw.text((120, y), f"{rng.integers(1, 500):>4}  {words}", font=body, fill=0)
+        draw.text(
+            (1300, y),
+            f"{rng.integers(1, 9999)},{rng.integers(0, 99):02d}",
+            font=body,
+            fill=0,
+        )
+        draw.line((110, y + 45, PAGE_SIZE[0] - 110, y + 45), fill=160, width=1)
+
+
+def render_wz_header(number: str, rng: np.random.Generator) -> Image.Image:
+    page = Image.new("L", PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(page)
+    draw.text((120, 100), f"{rng.choice(SUPPLIERS)} Sp. z o.o.", font=font(40), fill=0)
+    draw.text((120, 220), "WYDANIE ZEWNETRZNE", font=font(56), fill=0)
+    draw.text((120, 320), number, font=font(64), fill=0)
+    draw.rectangle((110, 480, PAGE_SIZE[0] - 110, 540), outline=0, width=3)
+    draw_rows(draw, rng, 580)
+    return page
+
+
+def render_continuation(rng: np.random.Generator) -> Image.Image:
+    page = Image.new("L", PAGE_SIZE, 255)
+    draw_rows(ImageDraw.Draw(page), rng, 150)
+    return page
+
+
+def render_blank() -> Image.Image:
+    return Image.new("L", PAGE_SIZE, 255)
+
+
+def add_scan_noise(page: Image.Image, rng: np.random.Generator) -> Image.Image:
+    parser = ImageParser(
+        np.array(page), path="synthetic/page.png", seed=int(rng.integers(2**63))
+    )
+    operations = [
+        parser.add_gaussian_noise,
+        parser.blur_image,
+        parser.rotate,
+        parser.enhance_contrast,
+        parser.enhance_brightness,
+    ]
+    for index in sorted(
+        rng.choice(len(operations), size=rng.integers(1, 4), replace=False)
+    ):
+        operations[index]()
+    return Image.fromarray(parser.image_array)
+
+
+def generate_document(
+    rng: np.random.Generator, pages: int, noise: float, blank: float
+) -> tuple[list[Image.Image], dict[str, list[int]]]:
+    images: list[Image.Image] = []
+    groups: dict[str, list[int]] = {}
+    number = None
+
+    if rng.random() < 0.3:
+        images.append(render_continuation(rng))
+
+    while len(images) < pages:
+        if number is None or rng.random() < 0.35:
+            number = random_wz_number(rng)
+            while number in groups:
+                number = random_wz_number(rng)
+            page = render_wz_header(number, rng)
+        elif rng.random() < blank:
+            images.append(render_blank())
+            continue
+        else:
+            page = render_continuation(rng)
+
+        if rng.random() < noise:
+            page = add_scan_noise(page, rng)
+
+        images.append(page)
+        groups.setdefault(number, []).append(len(images))
+
+    return [image.convert("RGB") for image in images], groups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic WZ documents.")
+    parser.add_argument("output", type=str, help="Directory for the generated PDFs.")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20, help="Pages per document.")
+    parser.add_argument(
+        "--noise", type=float, default=0.5, help="Share of noisy pages."
+    )
+    parser.add_argument(
+        "--blank", type=float, default=0.1, help="Share of blank pages."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    rng = np.random.default_rng(args.seed)
+    truth = {}
+
+    for index in range(1, args.documents + 1):
+        images, groups = generate_document(rng, args.pages, args.noise, args.blank)
+        file_name = f"synthetic_{index:03d}.pdf"
+        images[0].save(
+            os.path.join(args.output, file_name),
+            save_all=True,
+            append_images=images[1:],
+            resolution=DPI,
+        )
+        truth[file_name] = {"pages": len(images), "groups": groups}
+        print(f"Generated {file_name} ({len(images)} pages, {len(groups)} WZ's).")
+
+    with open(os.path.join(args.output, "truth.json"), "w") as f:
+        json.dump(truth, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+
+import numpy as np
+
+from benchmarks.synthetic import random_wz_number
+from core import cfg
+from core.reader import find_number
+from core.strategies import DEFAULT_ORDER
+
+# Share of OCR passes per cascade step that read the number cleanly, misread
+# a few characters, or lose it entirely.
+OUTCOMES = {"clean": 0.45, "confused": 0.35, "lost": 0.2}
+# Misreads of Tesseract and EasyOCR, written down independently of the table
+# in core.matching. Some give another valid digit (8/3, 7/1, 5/6), which no
+# matcher can undo, so the corpus also counts the wrong numbers accepted.
+CONFUSIONS = {
+    "0": ["O", "o", "D", "Q", "8"],
+    "1": ["I", "l", "|", "i", "7"],
+    "2": ["Z", "z", "7"],
+    "3": ["8", "B", "5"],
+    "4": ["A", "9"],
+    "5": ["S", "s", "6"],
+    "6": ["G", "b", "5"],
+    "7": ["1", "T", "?"],
+    "8": ["B", "3", "&"],
+    "9": ["g", "q", "4"],
+    "A": ["4", "R"],
+    "B": ["8", "3", "E"],
+    "C": ["G", "(", "O"],
+    "D": ["0", "O"],
+    "E": ["F", "3"],
+    "G": ["6", "C"],
+    "I": ["1", "l", "|"],
+    "M": ["N", "H"],
+    "O": ["0", "Q", "D"],
+    "S": ["5", "$"],
+    "T": ["7", "I"],
+    "W": ["VV", "w"],
+    "Z": ["2", "z"],
+    "/": [" / ", "l", "|", "1", "//"],
+    "-": ["", "~", "_", " - "],
+}
+NOISE = ["Data 12/05/2024", "NIP 123-456-32-18", "Strona 1/2", "Odbiorca:", ""]
+
+
+def confuse(number: str, rng: np.random.Generator) -> str:
+    chars = list(number)
+    for _ in range(rng.integers(1, 3)):
+        i = int(rng.integers(0, len(chars)))
+        if misreads := CONFUSIONS.get(chars[i]):
+            chars[i] = str(rng.choice(misreads))
+    return "".join(chars)
+
+
+def ocr_text(number: str | None, rng: np.random.Generator) -> str:
+    noise = str(rng.choice(NOISE))
+    if number is None:
+        return noise
+
+    outcome = rng.choice(list(OUTCOMES), p=list(OUTCOMES.values()))
+    if outcome == "clean":
+        return f"{noise} {number}"
+    if outcome == "confused":
+        return f"{noise} {confuse(number, rng)}"
+    return noise
+
+
+def generate(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(args.seed)
+    with open(args.output, "w") as f:
+        for _ in range(args.samples):
+            number = random_wz_number(rng) if rng.random() >= args.negatives else None
+            steps = [ocr_text(number, rng) for _ in DEFAULT_ORDER]
+            f.write(json.dumps({"expected": number, "steps": steps}) + "\n")
+    print(f"Wrote {args.samples} samples to {args.output}.")
+
+
+def evaluate(samples: list[dict], fuzzy: bool) -> dict:
+    cfg.WZ_FUZZY_MATCH = fuzzy
+    correct = wrong = invocations = 0
+
+    for sample in samples:
+        found = None
+        for text in sample["steps"]:
+            invocations += 1
+            if found := find_number(text):
+                break
+
+        correct += found == sample["expected"]
+        wrong += found is not None and found != sample["expected"]
+
+    return {
+        "mode": "tolerant" if fuzzy else "strict",
+        "accuracy": correct / len(samples),
+        "wrong_numbers": wrong,
+        "ocr_invocations": invocations,
+    }
+
+
+def run(args: argparse.Namespace) -> None:
+    cfg.WZ_MATCH_MIN_CONFIDENCE = args.min_confidence
+    with open(args.corpus) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    if not samples:
+        raise ValueError(f"No samples found in {args.corpus}.")
+
+    strict = evaluate(samples, fuzzy=False)
+    tolerant = evaluate(samples, fuzzy=True)
+    for result in (strict, tolerant):
+        print(
+            f"{result['mode']:>8}: accuracy {result['accuracy']:.3f}, "
+            f"{result['wrong_numbers']} wrong numbers, "
+            f"{result['ocr_invocations']} OCR invocations"
+        )
+
+    saved = strict["ocr_invocations"] - tolerant["ocr_invocations"]
+    print(
+        f"Saved {saved} OCR invocations "
+        f"({saved / strict['ocr_invocations']:.1%}) on {len(samples)} samples."
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare strict and OCR-confusion tolerant WZ number matching."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser(
+        "generate", help="Write a synthetic corpus of OCR outputs."
+    )
+    generate_parser.add_argument("output", type=str)
+    generate_parser.add_argument("--samples", type=int, default=1000)
+    generate_parser.add_argument(
+        "--negatives", type=float, default=0.1, help="Share of pages without a number."
+    )
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.set_defaults(handler=generate)
+
+    run_parser = commands.add_parser(
+        "run",
+        help="Replay a corpus of per-step OCR outputs through the cascade.",
+    )
+    run_parser.add_argument("corpus", type=str, help="JSON lines with expected/steps.")
+    run_parser.add_argument(
+        "--min-confidence", type=float, default=cfg.WZ_MATCH_MIN_CONFIDENCE
+    )
+    run_parser.set_defaults(handler=run)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Any, Callable
+
+import numpy as np
+
+from core import cfg
+
+_MISSING = object()
+
+
+def digest(array: np.ndarray) -> str:
+    array = np.ascontiguousarray(array)
+    sha = hashlib.sha256(f"{array.shape}:{array.dtype}:".encode())
+    sha.update(array.data)
+    return sha.hexdigest()
+
+
+class OcrCache:
+    def __init__(self, path: str, max_size_mb: int, enabled: bool = True) -> None:
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.enabled = enabled
+        self._lock = Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._writes = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked or spawned workers.
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def key(kind: str, params: dict, page_digest: str) -> str:
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{kind}|{payload}|{page_digest}".encode()).hexdigest()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return default
+
+            self.connection.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        payload = json.dumps(value)
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, payload, len(key) + len(payload), time.time()),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Drops the least recently used entries that no longer fit in max_size.
+        self.connection.execute(
+            "DELETE FROM entries WHERE key IN ("
+            "SELECT key FROM (SELECT key, SUM(size) OVER "
+            "(ORDER BY accessed DESC, key) AS total FROM entries) WHERE total > ?)",
+            (self.max_size,),
+        )
+
+    def memoize(
+        self,
+        kind: str,
+        params: dict,
+        get_digest: Callable[[], str],
+        compute: Callable[[], Any],
+    ) -> Any:
+        if not self.enabled:
+            return compute()
+
+        key = self.key(kind, params, get_digest())
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def relocate(self, path: str) -> None:
+        with self._lock:
+            self.path = path
+            self._connection = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("VACUUM")
+
+
+cache = OcrCache(cfg.CACHE_PATH, cfg.CACHE_MAX_MB, enabled=cfg.CACHE_ENABLED)
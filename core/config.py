@@ -2,7 +2,6 @@ import os
 import sys
 from os import PathLike
 
-import torch
 from pydantic_settings import BaseSettings
 
 ROOT_DIR = os.path.dirname(os.path.abspath(sys.argv[0]))
@@ -17,11 +16,85 @@ class Config(BaseSettings):
 
     IMG_WIDTH: int = 620
     IMG_HEIGHT: int = 877
+    CLASSIFIER_BATCH_SIZE: int = 16
+    CLASSIFIER_BACKEND: str = "keras"
+    CLASSIFIER_MODEL_PATH: PathLike | None = None
+
+    TEXT_LAYER: bool = True
+    RASTER_DPI: int = 200
+    CLASSIFY_DPI: int = 0
+    PAGE_WINDOW: int = 0
+    PAGE_MEMORY_LIMIT_MB: int = 0
+    PAGE_SPILL: bool = False
+    SPILL_DIR: PathLike | None = None
+    JOURNAL: bool = True
+
+    OUTPUT_MODE: str = "raster"
+    RASTER_BILEVEL: bool = False
+    BILEVEL_THRESHOLD: int = 160
+
+    EMPTY_PAGE_METHOD: str = "ink"
+    EMPTY_PAGE_DOWNSCALE: int = 4
+    EMPTY_INK_THRESHOLD: int = 128
+    EMPTY_INK_LOW: float = 0.001
+    EMPTY_INK_HIGH: float = 0.02
+
+    CPU_BUDGET: int = 0
+    CPU_AFFINITY: bool = False
+    CLASSIFIER_THREADS: int = 0
+    TORCH_THREADS: int = 0
+    TESSERACT_THREADS: int = 0
+    RASTER_THREADS: int = 0
+    THREAD_PROFILE_PATH: PathLike = os.path.join(ROOT_DIR, ".cache", "threads.json")
+
+    OCR_WORKERS: int = 0
+    OCR_STRATEGY_ORDER: str = "adaptive"
+    OCR_STRATEGY_PARALLEL: int = 1
+    OCR_STRATEGY_DETERMINISTIC: bool = False
+    EASYOCR_BATCH: bool = False
+    EASYOCR_BATCH_SIZE: int = 16
+    EASYOCR_DETECT_CANVAS: int = 1280
+    EASYOCR_FULL_FALLBACK: bool = True
+    FILE_WORKERS: int = 0
+
+    CACHE_ENABLED: bool = True
+    CACHE_PATH: PathLike = os.path.join(ROOT_DIR, ".cache", "wz_conv.sqlite3")
+    CACHE_MAX_MB: int = 512
+
+    WZ_FUZZY_MATCH: bool = True
+    WZ_MATCH_MIN_CONFIDENCE: float = 0.75
+
+    LAYOUT_REGIONS: bool = True
+    LAYOUT_STORE_PATH: PathLike = os.path.join(ROOT_DIR, ".cache", "layouts.sqlite3")
+    LAYOUT_MAX_DISTANCE: int = 24
+
+    DUPLICATES: str = "off"
+    DUPLICATES_INDEX_PATH: PathLike = os.path.join(
+        ROOT_DIR, ".cache", "duplicates.sqlite3"
+    )
+    DUPLICATE_MAX_DISTANCE: int = 0
+    DUPLICATE_HEADER_DISTANCE: int = 0
+
+    DATASET_PATH: PathLike = os.path.join(ROOT_DIR, "dataset")
+    AUGMENT_SEED: int = 42
+    AUGMENT_WORKERS: int = os.cpu_count() or 1
 
     WZ_IMAGES_DIR_PATH: PathLike = os.path.join(ROOT_DIR, "wz_images")
     NOT_WZ_IMAGES_DIR_PATH: PathLike = os.path.join(ROOT_DIR, "wz_images")
 
     WATCHER_COOLDOWN: int = 5
+    WATCHER_QUEUE_SIZE: int = 100
+    WATCHER_STABLE_SECONDS: float = 2.0
+    WATCHER_POLL_INTERVAL: float = 0.5
+
+    SPOOL_DIR_NAME: str = ".spool"
+    SPOOL_LEASE_SECONDS: float = 120.0
+    SPOOL_POLL_INTERVAL: float = 5.0
+
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9108
+    METRICS_SAMPLES: int = 10000
+    WARM_UP: bool = True
 
     class Config:
         env_file = ".env"
@@ -33,12 +106,18 @@ class Config(BaseSettings):
     def model_post_init(self, context):
         super().model_post_init(context)
 
-        if self.GPU_ENABLED:
-            if torch.cuda.is_available():
-                torch.cuda.set_per_process_memory_fraction(0.4, 0)
-            else:
-                raise RuntimeError(
-                    "GPU unavailable. Please check your CUDA installation or set GPU_ENABLED to False."
-                )
-        else:
+        if not self.GPU_ENABLED:
             os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+    def configure_gpu(self) -> None:
+        if not self.GPU_ENABLED:
+            return
+
+        import torch
+
+        if torch.cuda.is_available():
+            torch.cuda.set_per_process_memory_fraction(0.4, 0)
+        else:
+            raise RuntimeError(
+                "GPU unavailable. Please check your CUDA installation or set GPU_ENABLED to False."
+            )
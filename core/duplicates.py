@@ -0,0 +1,311 @@
+import argparse
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+from core import cfg
+
+MODES = ("off", "link", "skip")
+
+
+def _grey(page: np.ndarray) -> np.ndarray:
+    # Hashes only look at a few hundred pixels per side.
+    step = max(1, min(page.shape[:2]) // 512)
+    page = page[::step, ::step]
+    if page.ndim == 3:
+        page = page[..., :3].mean(axis=-1)
+    return page.astype(np.float32)
+
+
+def _resize(grey: np.ndarray, height: int, width: int) -> np.ndarray:
+    rows = np.linspace(0, grey.shape[0], height + 1).astype(int)
+    cols = np.linspace(0, grey.shape[1], width + 1).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(grey, rows[:-1], axis=0), cols[:-1], axis=1)
+    return sums / (np.diff(rows)[:, None] * np.diff(cols)[None, :])
+
+
+def _to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    k, n = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+
+DCT_32 = _dct_matrix(32)
+
+
+def phash(grey: np.ndarray) -> int:
+    # 64 bit pHash: the lowest 8x8 DCT frequencies of the page at 32x32,
+    # compared to their median.
+    low = (DCT_32 @ _resize(grey, 32, 32) @ DCT_32.T)[:8, :8]
+    return _to_int(low > np.median(low.ravel()[1:]))
+
+
+def dhash(grey: np.ndarray, height: int = 8, width: int = 16) -> int:
+    cells = _resize(grey, height, width + 1)
+    return _to_int(cells[:, 1:] > cells[:, :-1])
+
+
+def page_hashes(page: np.ndarray, header_band: float) -> tuple[int, int]:
+    # The pHash of the whole page finds candidates; the finer dHash of the
+    # header tells apart pages of one layout with different headers.
+    grey = _grey(page)
+    header = grey[: max(2, int(grey.shape[0] * header_band))]
+    return phash(grey), dhash(header)
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    def __init__(self) -> None:
+        # [key, items, {distance: child}]
+        self.root: Optional[list] = None
+
+    def add(self, key: int, item) -> None:
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            d = distance(key, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            if d not in node[2]:
+                node[2][d] = [key, [item], {}]
+                return
+            node = node[2][d]
+
+    def search(self, key: int, radius: int) -> list[tuple[int, object]]:
+        found = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node_key, items, children = nodes.pop()
+            d = distance(key, node_key)
+            if d <= radius:
+                found.extend((d, item) for item in items)
+            # Only subtrees within radius of d can hold matches.
+            nodes.extend(
+                child
+                for child_distance, child in children.items()
+                if d - radius <= child_distance <= d + radius
+            )
+        return found
+
+
+class DuplicateIndex:
+    def __init__(
+        self,
+        path: str,
+        max_distance: int,
+        header_distance: int,
+    ) -> None:
+        self.path = path
+        self.max_distance = max_distance
+        self.header_distance = header_distance
+        self._lock = Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._tree: BKTree | None = None
+        self._last_id = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "id INTEGER PRIMARY KEY, phash TEXT NOT NULL, dhash TEXT NOT NULL, "
+                "file TEXT NOT NULL, page INTEGER NOT NULL, class TEXT NOT NULL, "
+                "wz TEXT, empty INTEGER NOT NULL, seen REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "digest TEXT PRIMARY KEY, file TEXT NOT NULL, pages INTEGER, "
+                "seen REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                "file TEXT NOT NULL, page INTEGER, original_file TEXT NOT NULL, "
+                "original_page INTEGER, distance INTEGER NOT NULL, "
+                "action TEXT NOT NULL, seen REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+            self._tree = None
+        return self._connection
+
+    def _refresh(self) -> BKTree:
+        # Also picks up pages indexed by other processes since the last call.
+        connection = self.connection
+        if self._tree is None:
+            self._tree = BKTree()
+            self._last_id = 0
+        rows = connection.execute(
+            "SELECT id, phash, dhash, file, page, class, wz, empty FROM pages "
+            "WHERE id > ? ORDER BY id",
+            (self._last_id,),
+        ).fetchall()
+        for row_id, page_hash, header_hash, file, page, cls, wz, empty in rows:
+            self._tree.add(
+                int(page_hash, 16),
+                {
+                    "dhash": int(header_hash, 16),
+                    "file": file,
+                    "page": page,
+                    "class": cls,
+                    "wz": wz,
+                    "empty": bool(empty),
+                },
+            )
+            self._last_id = row_id
+        return self._tree
+
+    def find(self, page_hash: int, header_hash: int) -> Optional[dict]:
+        with self._lock:
+            candidates = [
+                (d + distance(header_hash, item["dhash"]), item)
+                for d, item in self._refresh().search(page_hash, self.max_distance)
+                if distance(header_hash, item["dhash"]) <= self.header_distance
+            ]
+        if not candidates:
+            return None
+        d, item = min(candidates, key=lambda candidate: candidate[0])
+        return {**item, "distance": d}
+
+    def add(self, rows: list[tuple]) -> None:
+        # rows: (phash, dhash, file, page, class, wz, empty)
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            self.connection.executemany(
+                "INSERT INTO pages (phash, dhash, file, page, class, wz, empty, seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (format(page_hash, "x"), format(header_hash, "x"), *row, now)
+                    for page_hash, header_hash, *row in rows
+                ],
+            )
+
+    def find_file(self, digest: str) -> Optional[dict]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT file, pages FROM files WHERE digest = ?", (digest,)
+            ).fetchone()
+        return None if row is None else {"file": row[0], "pages": row[1]}
+
+    def add_file(self, digest: str, file: str, pages: int) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO files (digest, file, pages, seen) "
+                "VALUES (?, ?, ?, ?)",
+                (digest, file, pages, time.time()),
+            )
+
+    def link(
+        self,
+        file: str,
+        page: Optional[int],
+        original: dict,
+        action: str,
+    ) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT INTO links (file, page, original_file, original_page, "
+                "distance, action, seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    file,
+                    page,
+                    original["file"],
+                    original.get("page"),
+                    original.get("distance", 0),
+                    action,
+                    time.time(),
+                ),
+            )
+
+    def report(self, limit: int = None) -> list[dict]:
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT file, page, original_file, original_page, distance, action, "
+                "seen FROM links ORDER BY seen DESC LIMIT ?",
+                (limit or -1,),
+            ).fetchall()
+        keys = ("file", "page", "original_file", "original_page", "distance")
+        return [
+            {**dict(zip(keys, row)), "action": row[5], "seen": row[6]} for row in rows
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                table: self.connection.execute(
+                    f"SELECT COUNT(*) FROM {table}"
+                ).fetchone()[0]
+                for table in ("pages", "files", "links")
+            }
+
+    def relocate(self, path: str) -> None:
+        with self._lock:
+            self.path = path
+            self._connection = None
+
+    def clear(self) -> None:
+        with self._lock:
+            for table in ("pages", "files", "links"):
+                self.connection.execute(f"DELETE FROM {table}")
+            self._tree = None
+
+
+duplicates = DuplicateIndex(
+    cfg.DUPLICATES_INDEX_PATH,
+    cfg.DUPLICATE_MAX_DISTANCE,
+    cfg.DUPLICATE_HEADER_DISTANCE,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Show the duplicate pages and documents found so far."
+    )
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--clear", action="store_true", help="Empty the index.")
+    args = parser.parse_args()
+
+    if args.clear:
+        duplicates.clear()
+        print(f"Cleared {duplicates.path}.")
+        return
+
+    stats = duplicates.stats()
+    print(
+        f"{stats['pages']} pages and {stats['files']} files indexed, "
+        f"{stats['links']} duplicates found."
+    )
+    for link in duplicates.report(args.limit):
+        page = "" if link["page"] is None else f" page {link['page']}"
+        original_page = (
+            "" if link["original_page"] is None else f" page {link['original_page']}"
+        )
+        print(
+            f"{link['file']}{page} -> {link['original_file']}{original_page}  "
+            f"distance={link['distance']} action={link['action']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
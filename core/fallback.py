@@ -0,0 +1,192 @@
+import re
+from itertools import groupby
+from threading import Lock
+from typing import Callable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from core import cfg
+from core.cache import cache
+from core.metrics import metrics
+from core.models import models
+from core.tracing import tracer
+
+easyocr_lock = Lock()
+
+WZ_TOKEN = re.compile(r"^\W{0,2}(W|VV|\\/\\/)\s{0,2}[Z2]", re.IGNORECASE)
+# Width of the start of a word, in multiples of its height, read to find tokens.
+TOKEN_WIDTH = 3
+# Largest gap between words of one line, in multiples of the word height.
+LINE_GAP = 2.0
+RECOGNIZE_PARAMS = {"contrast_ths": 0.2, "adjust_contrast": 0.7}
+_MISSING = object()
+
+
+def as_rgb(image: np.ndarray) -> np.ndarray:
+    return np.asarray(Image.fromarray(image).convert("RGB"))
+
+
+def as_grey(image: np.ndarray) -> np.ndarray:
+    return np.asarray(Image.fromarray(image).convert("L"))
+
+
+def line_box(boxes: List[list], token: list) -> list:
+    # Merges the token with the words following it on the same line.
+    x_min, x_max, y_min, y_max = token
+    height = y_max - y_min
+    center = (y_min + y_max) / 2
+    line = [token]
+    for box in sorted(boxes, key=lambda box: box[0]):
+        if box[0] <= line[-1][0] or abs((box[2] + box[3]) / 2 - center) > height / 2:
+            continue
+        if box[0] - line[-1][1] > LINE_GAP * height:
+            break
+        line.append(box)
+    return [
+        x_min,
+        max(box[1] for box in line),
+        min(box[2] for box in line),
+        max(box[3] for box in line),
+    ]
+
+
+# EasyOCR fallback for headers Tesseract could not read. Text is detected for
+# a batch of headers at once on a small canvas, the start of every word is
+# read with greedy decoding to find "WZ"-like tokens, and only the lines
+# starting with one are recognized, greedily first and with beam search if
+# that does not give a number.
+class EasyOcrFallback:
+    def __init__(self, canvas_size: int = None, batch_size: int = None) -> None:
+        self.canvas_size = canvas_size or cfg.EASYOCR_DETECT_CANVAS
+        self.batch_size = batch_size or cfg.EASYOCR_BATCH_SIZE
+
+    @property
+    def params(self) -> dict:
+        return {
+            "canvas_size": self.canvas_size,
+            "token_width": TOKEN_WIDTH,
+            "line_gap": LINE_GAP,
+            **RECOGNIZE_PARAMS,
+        }
+
+    def detect(self, headers: List[np.ndarray]) -> List[List[list]]:
+        boxes: List[List[list]] = [[] for _ in headers]
+        # Pages are only batched with pages of the same size.
+        order = sorted(range(len(headers)), key=lambda i: headers[i].shape[:2])
+        for _, group in groupby(order, key=lambda i: headers[i].shape[:2]):
+            group = list(group)
+            for start in range(0, len(group), self.batch_size):
+                chunk = group[start : start + self.batch_size]
+                batch = np.stack([as_rgb(headers[i]) for i in chunk])
+                with (
+                    easyocr_lock,
+                    metrics.stage("easyocr_detect"),
+                    tracer.span("reader.detect", pages=len(chunk)),
+                ):
+                    horizontal, _ = models.reader.detect(
+                        batch,
+                        canvas_size=self.canvas_size,
+                        width_ths=0.1,
+                        reformat=False,
+                    )
+                for i, page_boxes in zip(chunk, horizontal):
+                    height, width = headers[i].shape[:2]
+                    boxes[i] = [
+                        [
+                            max(0, int(x_min)),
+                            min(width, int(x_max)),
+                            max(0, int(y_min)),
+                            min(height, int(y_max)),
+                        ]
+                        for x_min, x_max, y_min, y_max in page_boxes
+                        if x_max > x_min and y_max > y_min
+                    ]
+        return boxes
+
+    def recognize(self, grey: np.ndarray, boxes: List[list], decoder: str) -> List[str]:
+        with (
+            easyocr_lock,
+            metrics.stage("easyocr"),
+            tracer.span("reader.recognize", boxes=len(boxes), decoder=decoder),
+        ):
+            results = models.reader.recognize(
+                grey,
+                horizontal_list=boxes,
+                free_list=[],
+                decoder=decoder,
+                batch_size=self.batch_size,
+                **RECOGNIZE_PARAMS,
+            )
+        # Results come back sorted by position, not in the order of the boxes.
+        texts = {(*corners[0], *corners[2]): text for corners, text, _ in results}
+        return [texts.get((box[0], box[2], box[1], box[3]), "") for box in boxes]
+
+    def read(
+        self,
+        header: np.ndarray,
+        boxes: List[list],
+        match: Callable[[str], Optional[str]],
+    ) -> Optional[str]:
+        if not boxes:
+            metrics.increment("easyocr_regions", result="no_text")
+            return None
+
+        grey = as_grey(header)
+        starts = [
+            [x_min, min(x_max, x_min + TOKEN_WIDTH * (y_max - y_min)), y_min, y_max]
+            for x_min, x_max, y_min, y_max in boxes
+        ]
+        tokens = [
+            box
+            for box, text in zip(boxes, self.recognize(grey, starts, "greedy"))
+            if WZ_TOKEN.match(text)
+        ]
+        if not tokens:
+            metrics.increment("easyocr_regions", result="no_token")
+            return None
+
+        lines = []
+        for token in tokens:
+            if (line := line_box(boxes, token)) not in lines:
+                lines.append(line)
+        for decoder in ("greedy", "beamsearch"):
+            for text in self.recognize(grey, lines, decoder):
+                if wz_nr := match(text):
+                    metrics.increment("easyocr_regions", result=decoder)
+                    return wz_nr
+
+        metrics.increment("easyocr_regions", result="miss")
+        return None
+
+    def run(
+        self,
+        headers: List[np.ndarray],
+        match: Callable[[str], Optional[str]],
+        digests: List[str] = None,
+    ) -> List[Optional[str]]:
+        numbers: List[Optional[str]] = [None] * len(headers)
+        keys = (
+            [cache.key("easyocr_regions", self.params, digest) for digest in digests]
+            if digests
+            else None
+        )
+
+        missing = []
+        for i in range(len(headers)):
+            value = cache.get(keys[i], _MISSING) if keys else _MISSING
+            if value is _MISSING:
+                missing.append(i)
+            else:
+                numbers[i] = value
+
+        if missing:
+            boxes = self.detect([headers[i] for i in missing])
+            for i, page_boxes in zip(missing, boxes):
+                numbers[i] = self.read(headers[i], page_boxes, match)
+                if keys:
+                    cache.set(keys[i], numbers[i])
+        return numbers
+
+
+fallback = EasyOcrFallback()
@@ -1,34 +1,269 @@
 import argparse
+import json
 import logging
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
 
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
 from core import cfg
+from core.cache import cache
+from core.duplicates import MODES
+from core.metrics import metrics
+from core.models import models
 from core.reader import PdfFileProcessor
+from core.resources import governor
+from core.spool import SpoolWorker
+from core.tracing import tracer
+
+
+def init_worker(cache_enabled: bool, profile: bool, plan: dict, slots) -> None:
+    cache.enabled = cache_enabled
+    tracer.enabled = profile
+    governor.plan = plan
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    governor.pin(slot)
+    models.load()
+
+
+def file_summary(file_path: str, **values) -> dict:
+    summary = {
+        "file": file_path,
+        "pages": 0,
+        "wz_count": 0,
+        "seconds": 0.0,
+        "error": None,
+    }
+    summary.update(values)
+    return summary
+
+
+def process_file(
+    file_path: str, output: str, options: dict, worker: bool = False
+) -> dict:
+    # Pool workers hand their metrics and trace events back with the summary
+    # so the parent process can report the whole run.
+    if worker:
+        metrics.reset()
+
+    started = time.perf_counter()
+    summary = file_summary(file_path)
+
+    try:
+        with metrics.stage("file"), tracer.span("file", file=file_path):
+            processor = PdfFileProcessor(file_path, output_dir=output, **options)
+            processor.process_pdf()
+            processor.save_all()
+        summary["pages"] = processor.pages_count
+        summary["wz_count"] = processor.wz_count
+        metrics.increment("files_processed")
+        metrics.increment("wz_created", processor.wz_count)
+    except Exception as e:
+        logging.error(f"Error: {file_path}: {e}")
+        summary["error"] = str(e)
+        metrics.increment("files_failed")
+
+    summary["seconds"] = time.perf_counter() - started
+    if worker:
+        summary["metrics"] = metrics.snapshot()
+        summary["trace"] = tracer.take()
+    return summary
 
 
 class Watcher(FileSystemEventHandler):
-    def __init__(self, output: str = None) -> None:
+    def __init__(
+        self,
+        output: str = None,
+        workers: int = None,
+        queue_size: int = None,
+        **options,
+    ) -> None:
         super().__init__()
         self.output = output
+        self.options = options
+        self.workers = workers or governor.file_workers
+        self.jobs: Queue = Queue(maxsize=queue_size or cfg.WATCHER_QUEUE_SIZE)
+        self._lock = Lock()
+        self._stop = Event()
+        self._known: set[str] = set()
+        self._pending: dict[str, tuple[int, float]] = {}
+        self._threads: list[Thread] = []
+        metrics.gauge("queue_depth", self.jobs.qsize)
+        metrics.gauge("files_pending", lambda: len(self._pending))
+
+        # Worker threads share the models of this process.
+        governor.configure(self.workers, shared=True)
+        governor.pin()
+        if not self.options.get("ocr_workers"):
+            self.options["ocr_workers"] = governor.page_threads
 
     def on_created(self, event):
-        if not event.is_directory and event.src_path.lower().endswith(".pdf"):
+        if not event.is_directory:
+            self.track(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.track(event.dest_path)
+
+    def track(self, file_path: str) -> None:
+        if not file_path.lower().endswith(".pdf"):
+            return
+
+        with self._lock:
+            # Repeated events for a file that is already waiting, queued or
+            # being processed are ignored.
+            if file_path in self._known:
+                return
+            self._known.add(file_path)
+            self._pending[file_path] = (-1, time.monotonic())
+
+        logging.info(f"New file found: {file_path}")
+
+    def scan(self, dir_path: str) -> None:
+        for file_path in FileHandler.loop_files(dir_path):
+            self.track(file_path)
+
+    def _stable_files(self) -> list[str]:
+        now = time.monotonic()
+        stable = []
+
+        with self._lock:
+            for file_path, (last_size, since) in list(self._pending.items()):
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
+                    del self._pending[file_path]
+                    self._known.discard(file_path)
+                    continue
+
+                if size != last_size:
+                    self._pending[file_path] = (size, now)
+                elif size and now - since >= cfg.WATCHER_STABLE_SECONDS:
+                    del self._pending[file_path]
+                    stable.append(file_path)
+
+        return stable
+
+    def _enqueue_stable(self) -> None:
+        while not self._stop.wait(cfg.WATCHER_POLL_INTERVAL):
+            for file_path in self._stable_files():
+                # Blocks while the queue is full, so files wait in the pending
+                # set instead of piling up behind busy workers.
+                while not self._stop.is_set():
+                    try:
+                        self.jobs.put(file_path, timeout=cfg.WATCHER_POLL_INTERVAL)
+                        break
+                    except Full:
+                        logging.info(f"Job queue full, waiting to enqueue {file_path}")
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                file_path = self.jobs.get(timeout=cfg.WATCHER_POLL_INTERVAL)
+            except Empty:
+                continue
+            try:
+                process_file(file_path, self.output, self.options)
+            finally:
+                with self._lock:
+                    self._known.discard(file_path)
+                self.jobs.task_done()
+
+    def start(self) -> None:
+        self._threads = [Thread(target=self._enqueue_stable, daemon=True)]
+        self._threads += [
+            Thread(target=self._work, daemon=True) for _ in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        # Workers finish the file they are processing. Queued files stay in
+        # the input directory and are found again by the scan on startup.
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+        dropped = 0
+        while True:
             try:
-                logging.info(f"New file found: {event.src_path}")
-                FileHandler(path=event.src_path, output=self.output).start_processing()
-            except Exception as e:
-                logging.error(f"Error: {event.src_path}: {e}")
+                self.jobs.get_nowait()
+            except Empty:
+                break
+            self.jobs.task_done()
+            dropped += 1
+        if dropped:
+            logging.info(f"Left {dropped} queued files for the next start")
 
 
 class FileHandler:
-    def __init__(self, path: str, output: str, watch: bool = False) -> None:
+    def __init__(
+        self,
+        path: str,
+        output: str,
+        watch: bool = False,
+        spool: bool = False,
+        page_window: int = None,
+        memory_limit: int = None,
+        ocr_workers: int = None,
+        text_layer: bool = None,
+        output_mode: str = None,
+        bilevel: bool = None,
+        classify_dpi: int = None,
+        spill: bool = None,
+        journal: bool = None,
+        duplicates: str = None,
+        workers: int = None,
+        warm_up: bool = None,
+        cache: bool = None,
+        clear_cache: bool = False,
+        metrics_port: int = None,
+        metrics_json: str = None,
+        profile: str = None,
+    ) -> None:
         self.path = path
         self.output = output
         self.watch = watch
+        self.spool = spool
+        self.page_window = page_window
+        self.memory_limit = memory_limit
+        self.ocr_workers = ocr_workers
+        self.text_layer = text_layer
+        self.output_mode = output_mode
+        self.bilevel = bilevel
+        self.classify_dpi = classify_dpi
+        self.spill = spill
+        self.journal = journal
+        self.duplicates = duplicates
+        self.workers = workers or governor.file_workers
+        self.warm_up = cfg.WARM_UP if warm_up is None else warm_up
+        self.cache = cache
+        self.clear_cache = clear_cache
+        self.metrics_port = cfg.METRICS_PORT if metrics_port is None else metrics_port
+        self.metrics_json = metrics_json
+        self.profile = profile
+
+    @property
+    def processor_options(self) -> dict:
+        return {
+            "page_window": self.page_window,
+            "memory_limit": self.memory_limit,
+            "ocr_workers": self.ocr_workers,
+            "text_layer": self.text_layer,
+            "output_mode": self.output_mode,
+            "bilevel": self.bilevel,
+            "classify_dpi": self.classify_dpi,
+            "spill": self.spill,
+            "journal": self.journal,
+            "duplicates": self.duplicates,
+        }
 
     @staticmethod
     def _parse_args():
@@ -45,6 +280,112 @@ class FileHandler:
         parser.add_argument(
             "--watch", action="store_true", help="Watch the directory for new files."
         )
+        parser.add_argument(
+            "--spool",
+            action="store_true",
+            help="Work on the directory together with other workers sharing it, "
+            "claiming files with leases.",
+        )
+        parser.add_argument(
+            "--page-window",
+            type=int,
+            help="Rasterize and process at most this many pages at a time.",
+        )
+        parser.add_argument(
+            "--memory-limit",
+            type=int,
+            help="Approximate peak memory (MB) for rasterized pages kept at once.",
+        )
+        parser.add_argument(
+            "--ocr-workers",
+            type=int,
+            help="Number of pages OCR'd concurrently within a single file.",
+        )
+        parser.add_argument(
+            "--no-text-layer",
+            dest="text_layer",
+            action="store_false",
+            default=None,
+            help="Always rasterize and OCR pages, even if they carry a text layer.",
+        )
+        parser.add_argument(
+            "--spill",
+            action="store_true",
+            default=None,
+            help="Keep analysed pages waiting to be saved in memory-mapped files "
+            "(with --page-window or --memory-limit).",
+        )
+        parser.add_argument(
+            "--no-journal",
+            dest="journal",
+            action="store_false",
+            default=None,
+            help="Do not journal analysed pages and written WZ's to resume "
+            "interrupted files.",
+        )
+        parser.add_argument(
+            "--duplicates",
+            choices=MODES,
+            help="Link pages seen before to their earlier results (link) and also "
+            "skip copies of processed files and WZ's (skip), or neither (off).",
+        )
+        parser.add_argument(
+            "--output-mode",
+            choices=["raster", "copy"],
+            help="Write WZ files from rendered pages (raster) or by copying the "
+            "original PDF pages without re-encoding (copy).",
+        )
+        parser.add_argument(
+            "--bilevel",
+            action="store_true",
+            default=None,
+            help="Store raster output as black and white CCITT G4 images.",
+        )
+        parser.add_argument(
+            "--classify-dpi",
+            type=int,
+            help="Render pages at this DPI for classification and empty-page checks, "
+            "and only the header band of WZ pages at full DPI for OCR.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of PDF files processed in parallel worker processes.",
+        )
+        parser.add_argument(
+            "--no-warm-up",
+            dest="warm_up",
+            action="store_false",
+            default=None,
+            help="Do not load and warm up the models before watching.",
+        )
+        parser.add_argument(
+            "--no-cache",
+            dest="cache",
+            action="store_false",
+            default=None,
+            help="Do not read or write the OCR and classification cache.",
+        )
+        parser.add_argument(
+            "--clear-cache",
+            action="store_true",
+            help="Remove all entries from the OCR and classification cache.",
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            help="Port of the Prometheus metrics endpoint in watch mode (0 disables).",
+        )
+        parser.add_argument(
+            "--metrics-json",
+            type=str,
+            help="Write a JSON summary of the run metrics to this file.",
+        )
+        parser.add_argument(
+            "--profile",
+            type=str,
+            help="Write a Chrome trace / Perfetto timeline of the run to this file.",
+        )
 
         return parser.parse_args()
 
@@ -71,39 +412,167 @@ class FileHandler:
 
         return pdf_file_paths
 
-    def start_processing(self):
+    def _configure_cache(self) -> None:
+        if self.cache is not None:
+            cache.enabled = self.cache
+
+        if self.clear_cache:
+            cache.clear()
+            print(f"Cleared cache {cache.path}.")
+
+    def start_processing(self) -> list[dict]:
+        self._configure_cache()
+        tracer.enabled = bool(self.profile)
+
         if os.path.isfile(self.path) and self.path.lower().endswith(".pdf"):
-            files = [PdfFileProcessor(self.path, output_dir=self.output)]
+            pdf_file_paths = [self.path]
             print("Processing single PDF file: ", self.path)
         elif os.path.isdir(self.path):
             pdf_file_paths = self.loop_files(self.path)
+            print(
+                f"Processing PDF files (total: {len(pdf_file_paths)}) from directory: {self.path}."
+            )
+        else:
+            raise AttributeError(f"{self.path} is neither a directory nor a PDF file.")
+
+        if not pdf_file_paths:
+            return []
 
-            files = [
-                PdfFileProcessor(file_path, output_dir=self.output)
+        if self.workers > 1 and len(pdf_file_paths) > 1:
+            summaries = self._process_in_pool(pdf_file_paths)
+        else:
+            governor.configure(1)
+            governor.pin()
+            summaries = [
+                process_file(file_path, self.output, self.processor_options)
                 for file_path in pdf_file_paths
             ]
+
+        self._print_summary(summaries)
+        self._report_metrics()
+
+        if self.profile:
+            tracer.export(self.profile)
+
+        return summaries
+
+    def _report_metrics(self) -> None:
+        summary = json.dumps(metrics.summary())
+        print(f"Metrics: {summary}")
+
+        if self.metrics_json:
+            with open(self.metrics_json, "w") as f:
+                f.write(summary)
+
+    def _process_in_pool(self, pdf_file_paths: list[str]) -> list[dict]:
+        workers = min(self.workers, len(pdf_file_paths))
+        plan = governor.configure(workers)
+        options = self.processor_options
+        if not options["ocr_workers"]:
+            options["ocr_workers"] = governor.page_threads
+
+        summaries = []
+        context = get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(cache.enabled, tracer.enabled, plan, context.Value("i", 0)),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    process_file, file_path, self.output, options, True
+                ): file_path
+                for file_path in pdf_file_paths
+            }
+            for future in as_completed(futures):
+                try:
+                    summary = future.result()
+                    metrics.merge(summary.pop("metrics"))
+                    tracer.extend(summary.pop("trace"))
+                    summaries.append(summary)
+                except Exception as e:
+                    logging.error(f"Error: {futures[future]}: {e}")
+                    summaries.append(file_summary(futures[future], error=str(e)))
+
+        order = {file_path: i for i, file_path in enumerate(pdf_file_paths)}
+        return sorted(summaries, key=lambda summary: order[summary["file"]])
+
+    @staticmethod
+    def _print_summary(summaries: list[dict]) -> None:
+        for summary in summaries:
+            status = f"FAILED ({summary['error']})" if summary["error"] else "OK"
             print(
-                f"Processing PDF files (total: {len(files)}) from directory: {self.path}."
+                f"{os.path.basename(summary['file'])}: {summary['pages']} pages, "
+                f"{summary['wz_count']} WZ's, {summary['seconds']:.1f}s, {status}"
             )
-        else:
-            raise AttributeError(f"{self.path} is neither a directory nor a PDF file.")
 
-        for file in files:
-            file.process_pdf()
-            file.save_all()
+        failed = sum(1 for summary in summaries if summary["error"])
+        if failed:
+            print(f"{failed} of {len(summaries)} files failed.")
 
     def start_watching(
         self,
     ) -> None:
-        event_handler = Watcher(output=self.output)
+        self._configure_cache()
+        tracer.enabled = bool(self.profile)
+        governor.configure(self.workers, shared=True)
+
+        if self.warm_up:
+            models.load()
+            models.warm_up()
+
+        if self.metrics_port:
+            metrics.serve(self.metrics_port)
+
+        event_handler = Watcher(
+            output=self.output, workers=self.workers, **self.processor_options
+        )
         observer = Observer()
         observer.schedule(event_handler, path=self.path, recursive=False)
         observer.start()
+        event_handler.start()
+        event_handler.scan(self.path)
 
         try:
             while True:
                 time.sleep(cfg.WATCHER_COOLDOWN)
-                logging.info("Monitoring folder for new files...")
+                logging.info(
+                    f"Monitoring folder for new files... "
+                    f"(queued: {event_handler.jobs.qsize()})"
+                )
         except KeyboardInterrupt:
             observer.stop()
         observer.join()
+        event_handler.stop()
+
+        if self.profile:
+            tracer.export(self.profile)
+
+    def start_spool(self) -> int:
+        self._configure_cache()
+        tracer.enabled = bool(self.profile)
+        governor.configure(1)
+        governor.pin()
+
+        if self.warm_up:
+            models.load()
+            models.warm_up()
+
+        if self.metrics_port and self.watch:
+            metrics.serve(self.metrics_port)
+
+        options = self.processor_options
+        if not options["ocr_workers"]:
+            options["ocr_workers"] = governor.page_threads
+
+        worker = SpoolWorker(self.path, self.output, options)
+        try:
+            processed = worker.run(watch=self.watch)
+        except KeyboardInterrupt:
+            processed = 0
+
+        self._report_metrics()
+        if self.profile:
+            tracer.export(self.profile)
+        return processed
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Optional
+
+
+def file_digest(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# Append-only JSON lines next to the output of a file: one record per analysed
+# page, a write/written pair around every WZ group saved and a skip record for
+# every group kept as a duplicate of an existing file, so a restarted run
+# can skip the pages and groups that are already done. A journal written for
+# another version of the file or with other settings is started over.
+class PageJournal:
+    def __init__(self, path: str, digest: str, params: dict) -> None:
+        self.path = path
+        self.header = {"type": "file", "digest": digest, "params": params}
+        self.pages: dict[int, tuple[str, Optional[str], bool]] = {}
+        self.groups: dict[str, list[int]] = {}
+        self.skipped: dict[str, list[int]] = {}
+        self.pending: Optional[dict] = None
+        self._lock = Lock()
+
+        records = self._read()
+        if records[:1] != [self.header]:
+            records = [self.header]
+        for record in records[1:]:
+            self._replay(record)
+
+        # Rewriting drops a record torn by the crash.
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        os.replace(tmp_path, path)
+        self._file = open(path, "a")
+
+    def _read(self) -> list[dict]:
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        return records
+
+    def _replay(self, record: dict) -> None:
+        if record["type"] == "page":
+            self.pages[record["page"]] = (
+                record["class"],
+                record["wz"],
+                record["empty"],
+            )
+        elif record["type"] == "write":
+            self.pending = record
+        elif record["type"] == "written" and self.pending:
+            self.groups.setdefault(self.pending["wz"], []).extend(self.pending["pages"])
+            self.pending = None
+        elif record["type"] == "forget":
+            self.groups.pop(record["wz"], None)
+        elif record["type"] == "skip":
+            self.skipped.setdefault(record["wz"], []).extend(record["pages"])
+
+    @property
+    def written_pages(self) -> set[int]:
+        groups = [*self.groups.values(), *self.skipped.values()]
+        return {page for pages in groups for page in pages}
+
+    def _append(self, record: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._replay(record)
+
+    def page(self, page: int, cls: str, wz: Optional[str], empty: bool) -> None:
+        self._append({
+            "type": "page",
+            "page": page,
+            "class": cls,
+            "wz": wz,
+            "empty": empty,
+        })
+
+    def write(self, wz: str, pages: list[int], total: int) -> None:
+        self._append({"type": "write", "wz": wz, "pages": pages, "total": total})
+
+    def written(self) -> None:
+        self._append({"type": "written"})
+
+    def skip(self, wz: str, pages: list[int]) -> None:
+        self._append({"type": "skip", "wz": wz, "pages": pages})
+
+    def forget(self, wz: str) -> None:
+        self._append({"type": "forget", "wz": wz})
+
+    def discard_pending(self) -> None:
+        self.pending = None
+
+    def remove(self) -> None:
+        self._file.close()
+        os.remove(self.path)
@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from core import cfg
+
+GRID = (32, 12)
+
+
+def fingerprint(page: np.ndarray, header_band: float) -> int:
+    # A coarse ink map of the header: logos, table rules and text blocks of a
+    # supplier's layout land in the same cells, while the varying text does not
+    # change enough cells to matter.
+    if page.ndim == 3:
+        page = page[..., :3].mean(axis=-1)
+    header = page[: max(1, int(page.shape[0] * header_band))].astype(np.uint8)
+    cells = np.asarray(Image.fromarray(header).resize(GRID, Image.BOX), np.float32)
+    bits = (cells < np.median(cells) - 8).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class LayoutStore:
+    def __init__(self, path: str, max_distance: int, enabled: bool = True) -> None:
+        self.path = path
+        self.max_distance = max_distance
+        self.enabled = enabled
+        self._lock = Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._regions: dict[int, tuple] | None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS regions ("
+                "fingerprint TEXT PRIMARY KEY, x0 REAL, y0 REAL, x1 REAL, y1 REAL, "
+                "hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0, "
+                "updated REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+            self._regions = None
+        return self._connection
+
+    @property
+    def regions(self) -> dict[int, tuple]:
+        if self._regions is None:
+            rows = self.connection.execute(
+                "SELECT fingerprint, x0, y0, x1, y1 FROM regions"
+            ).fetchall()
+            self._regions = {int(key, 16): tuple(box) for key, *box in rows}
+        return self._regions
+
+    def find(self, key: int) -> Optional[tuple[int, tuple]]:
+        with self._lock:
+            regions = self.regions
+            if key in regions:
+                return key, regions[key]
+
+            nearest = min(
+                regions, key=lambda known: (known ^ key).bit_count(), default=None
+            )
+            if nearest is None or (nearest ^ key).bit_count() > self.max_distance:
+                return None
+            return nearest, regions[nearest]
+
+    def learn(self, key: int, box: tuple) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT INTO regions (fingerprint, x0, y0, x1, y1, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (fingerprint) DO UPDATE SET "
+                "x0 = excluded.x0, y0 = excluded.y0, x1 = excluded.x1, "
+                "y1 = excluded.y1, updated = excluded.updated",
+                (format(key, "x"), *box, time.time()),
+            )
+            self.regions[key] = tuple(box)
+
+    def record(self, key: int, hit: bool) -> None:
+        column = "hits" if hit else "misses"
+        with self._lock:
+            self.connection.execute(
+                f"UPDATE regions SET {column} = {column} + 1 WHERE fingerprint = ?",
+                (format(key, "x"),),
+            )
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT fingerprint, x0, y0, x1, y1, hits, misses FROM regions "
+                "ORDER BY hits + misses DESC"
+            ).fetchall()
+        return [
+            {"fingerprint": key, "box": box, "hits": hits, "misses": misses}
+            for key, *box, hits, misses in rows
+        ]
+
+    def relocate(self, path: str) -> None:
+        with self._lock:
+            self.path = path
+            self._connection = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self.connection.execute("DELETE FROM regions")
+            self._regions = None
+
+
+layouts = LayoutStore(
+    cfg.LAYOUT_STORE_PATH, cfg.LAYOUT_MAX_DISTANCE, enabled=cfg.LAYOUT_REGIONS
+)
+
+
+if __name__ == "__main__":
+    for layout in layouts.stats():
+        total = layout["hits"] + layout["misses"]
+        rate = layout["hits"] / total if total else 0.0
+        box = ", ".join(f"{value:.3f}" for value in layout["box"])
+        print(
+            f"{layout['fingerprint'][:16]}  box=({box})  "
+            f"hits={layout['hits']} misses={layout['misses']} hit rate={rate:.1%}"
+        )
@@ -0,0 +1,84 @@
+import re
+from typing import Optional
+
+# Characters OCR engines commonly return instead of a digit or a letter.
+AS_DIGIT = {
+    "O": "0",
+    "o": "0",
+    "Q": "0",
+    "D": "0",
+    "I": "1",
+    "l": "1",
+    "i": "1",
+    "|": "1",
+    "!": "1",
+    "Z": "2",
+    "z": "2",
+    "S": "5",
+    "s": "5",
+    "B": "8",
+    "G": "6",
+    "b": "6",
+    "g": "9",
+    "q": "9",
+    "A": "4",
+}
+AS_LETTER = {"0": "O", "1": "I", "2": "Z", "5": "S", "8": "B", "6": "G", "4": "A"}
+
+_DIGIT = "[0-9" + re.escape("".join(AS_DIGIT)) + "]"
+_SLASH = r"\s{0,2}[/\\]\s{0,2}"
+LOOSE_PATTERN = re.compile(
+    r"(?<![A-Za-z])(W|VV|\\/\\/)\s{0,2}([Z2z])\s{0,2}([-–—~_.:]?)\s{0,2}"
+    rf"({_DIGIT}{{1,6}}){_SLASH}({_DIGIT}{{1,4}}){_SLASH}"
+    rf"([A-Za-z0-9]{{1,10}}){_SLASH}({_DIGIT}{{2,4}})(?![0-9])"
+)
+
+SUBSTITUTION_PENALTY = 0.08
+CASE_PENALTY = 0.03
+SEPARATOR_PENALTY = 0.05
+SPACING_PENALTY = 0.02
+PLAUSIBILITY_PENALTY = 0.1
+
+
+def _digits(field: str) -> tuple[str, int]:
+    normalized = "".join(AS_DIGIT.get(char, char) for char in field)
+    return normalized, sum(char not in "0123456789" for char in field)
+
+
+def _letters(field: str) -> tuple[str, int, int]:
+    normalized = "".join(AS_LETTER.get(char, char) for char in field).upper()
+    substitutions = sum(char in AS_LETTER for char in field)
+    lowercase = sum(char.islower() for char in field)
+    return normalized, substitutions, lowercase
+
+
+def score_candidate(match: re.Match) -> tuple[str, float]:
+    w, z, dash, number, month, supplier, year = match.groups()
+    number, number_fixes = _digits(number)
+    month, month_fixes = _digits(month)
+    year, year_fixes = _digits(year)
+    supplier, supplier_fixes, lowercase = _letters(supplier)
+
+    penalty = SUBSTITUTION_PENALTY * (
+        number_fixes
+        + month_fixes
+        + year_fixes
+        + supplier_fixes
+        + (w != "W")
+        + (z != "Z")
+    )
+    penalty += CASE_PENALTY * lowercase
+    penalty += SEPARATOR_PENALTY * (dash != "-")
+    penalty += SPACING_PENALTY * len(re.findall(r"\s+", match.group(0)))
+    # Digits read into the supplier code are only plausible as confusions, and
+    # WZ numbers carry a month and a four digit year.
+    penalty += PLAUSIBILITY_PENALTY * (not supplier.isalpha())
+    penalty += PLAUSIBILITY_PENALTY * (not 1 <= int(month) <= 12)
+    penalty += PLAUSIBILITY_PENALTY * (len(year) != 4)
+
+    return f"WZ-{number}/{month}/{supplier}/{year}", max(0.0, 1.0 - penalty)
+
+
+def best_match(content: str) -> Optional[tuple[str, float]]:
+    candidates = [score_candidate(match) for match in LOOSE_PATTERN.finditer(content)]
+    return max(candidates, key=lambda candidate: candidate[1], default=None)
@@ -0,0 +1,177 @@
+import json
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Iterator
+
+import numpy as np
+
+from core import cfg
+
+PREFIX = "wz_conv"
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{{{pairs}}}"
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.started = time.time()
+        self.counters: dict[tuple[str, tuple], float] = defaultdict(float)
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self.timings: dict[str, deque] = defaultdict(
+            lambda: deque(maxlen=cfg.METRICS_SAMPLES)
+        )
+        self.totals: dict[str, list[float]] = defaultdict(lambda: [0, 0.0])
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.timings[name].append(seconds)
+            self.totals[name][0] += 1
+            self.totals[name][1] += seconds
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "timings": {
+                    name: list(values) for name, values in self.timings.items()
+                },
+                "totals": {name: list(total) for name, total in self.totals.items()},
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        with self._lock:
+            for name, labels, value in snapshot["counters"]:
+                self.counters[(name, tuple(sorted(labels.items())))] += value
+            for name, values in snapshot["timings"].items():
+                self.timings[name].extend(values)
+            for name, (count, seconds) in snapshot["totals"].items():
+                self.totals[name][0] += count
+                self.totals[name][1] += seconds
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.timings.clear()
+            self.totals.clear()
+
+    def stage_stats(self) -> dict[str, dict]:
+        snapshot = self.snapshot()
+        stats = {}
+        for name, values in sorted(snapshot["timings"].items()):
+            count, seconds = snapshot["totals"][name]
+            samples = np.array(values) * 1000
+            stats[name] = {
+                "count": count,
+                "total_ms": seconds * 1000,
+                **{
+                    f"p{int(quantile * 100)}_ms": float(np.quantile(samples, quantile))
+                    for quantile in QUANTILES
+                },
+            }
+        return stats
+
+    def summary(self) -> dict:
+        elapsed = time.time() - self.started
+        counters = defaultdict(dict)
+        for name, labels, value in self.snapshot()["counters"]:
+            key = ",".join(f"{k}={v}" for k, v in labels.items()) or "total"
+            counters[name][key] = value
+
+        files = counters.get("files_processed", {}).get("total", 0)
+        return {
+            "uptime_seconds": elapsed,
+            "files_per_minute": files / elapsed * 60 if elapsed else 0.0,
+            "counters": dict(counters),
+            "gauges": {name: read() for name, read in self.gauges.items()},
+            "stages": self.stage_stats(),
+        }
+
+    def to_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        by_name = defaultdict(list)
+        for name, labels, value in snapshot["counters"]:
+            by_name[name].append((labels, value))
+        for name, values in sorted(by_name.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for labels, value in values:
+                lines.append(f"{PREFIX}_{name}_total{_labels(labels)} {value}")
+
+        for name, read in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {read()}")
+
+        lines.append(f"# TYPE {PREFIX}_stage_seconds summary")
+        for name, values in sorted(snapshot["timings"].items()):
+            count, seconds = snapshot["totals"][name]
+            for quantile in QUANTILES:
+                labels = _labels({"stage": name, "quantile": quantile})
+                value = float(np.quantile(values, quantile))
+                lines.append(f"{PREFIX}_stage_seconds{labels} {value}")
+            labels = _labels({"stage": name})
+            lines.append(f"{PREFIX}_stage_seconds_sum{labels} {seconds}")
+            lines.append(f"{PREFIX}_stage_seconds_count{labels} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = None) -> ThreadingHTTPServer:
+        server = ThreadingHTTPServer((host or cfg.METRICS_HOST, port), MetricsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Serving metrics on http://{server.server_address[0]}:{port}/")
+        return server
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = metrics.to_prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(metrics.summary()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+metrics = Metrics()
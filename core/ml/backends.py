@@ -0,0 +1,152 @@
+import os
+from threading import Lock
+
+import numpy as np
+
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, model) -> None:
+        self.model = model
+        self._compiled: dict = {}
+
+    @classmethod
+    def load(cls, model_path: str, threads: int = None) -> "KerasBackend":
+        if threads:
+            import tensorflow as tf
+
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError:
+                pass  # The TensorFlow runtime was already initialized.
+
+        from keras.src.saving import load_model
+
+        return cls(load_model(model_path))
+
+    @property
+    def input_shape(self) -> tuple:
+        return tuple(self.model.input_shape)
+
+    def _forward(self, batch_size: int):
+        if batch_size in self._compiled:
+            return self._compiled[batch_size]
+
+        import tensorflow as tf
+
+        signature = tf.TensorSpec((batch_size, *self.input_shape[1:]), dtype=tf.float32)
+        forward = tf.function(
+            lambda x: self.model(x, training=False), input_signature=[signature]
+        )
+        self._compiled[batch_size] = forward
+        return forward
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        import tensorflow as tf
+
+        return self._forward(len(batch))(tf.constant(batch)).numpy()[:, 0]
+
+
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, model_path: str, threads: int = None) -> None:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                from tensorflow.lite import Interpreter
+
+        self.interpreter = Interpreter(model_path=model_path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter's tensors are shared, so one batch runs at a time.
+        self._lock = Lock()
+
+    @property
+    def input_shape(self) -> tuple:
+        return (None, *(int(size) for size in self._input["shape"][1:]))
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(
+                    self._input["index"], [len(batch), *self.input_shape[1:]]
+                )
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = len(batch)
+
+            # Fully int8 models expect quantized input and return quantized output.
+            scale, zero_point = self._input["quantization"]
+            if self._input["dtype"] != np.float32 and scale:
+                info = np.iinfo(self._input["dtype"])
+                batch = np.clip(
+                    np.round(batch / scale + zero_point), info.min, info.max
+                )
+            self.interpreter.set_tensor(
+                self._input["index"], batch.astype(self._input["dtype"])
+            )
+            self.interpreter.invoke()
+
+            output = self.interpreter.get_tensor(self._output["index"]).astype(
+                np.float32
+            )
+            scale, zero_point = self._output["quantization"]
+            if self._output["dtype"] != np.float32 and scale:
+                output = (output - zero_point) * scale
+            return output[:, 0]
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_path: str, threads: int = None) -> None:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input = self.session.get_inputs()[0]
+
+    @property
+    def input_shape(self) -> tuple:
+        return (None, *(int(size) for size in self._input.shape[1:]))
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        (output,) = self.session.run(None, {self._input.name: batch})
+        return output[:, 0]
+
+
+BACKENDS = {
+    "keras": KerasBackend.load,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def exported_model_path(model_path: str, backend: str) -> str:
+    return f"{os.path.splitext(model_path)[0]}.{backend}"
+
+
+def load_backend(backend: str, model_path: str, threads: int = None):
+    loader = BACKENDS.get(backend)
+    if loader is None:
+        raise ValueError(
+            f"Unknown classifier backend {backend}, use one of: {', '.join(BACKENDS)}."
+        )
+    return loader(model_path, threads)
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from multiprocessing import get_context
+
+import numpy as np
+
+from core import cfg
+from core.ml.parser import ImageParser, image_seed
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def header_height() -> int:
+    return cfg.IMG_HEIGHT // 4
+
+
+def augment_file(task: tuple[str, int]) -> np.ndarray:
+    path, seed = task
+    parser = ImageParser.read_image(path, seed)
+    return np.stack([image[: header_height()] for image in parser.augmentations()])
+
+
+def list_files(input_dir: str) -> tuple[list[str], list[tuple[str, int]]]:
+    # Same class order as tf.keras.utils.image_dataset_from_directory.
+    classes = sorted(
+        name
+        for name in os.listdir(input_dir)
+        if os.path.isdir(os.path.join(input_dir, name))
+    )
+    files = [
+        (os.path.join(input_dir, name, file_name), label)
+        for label, name in enumerate(classes)
+        for file_name in sorted(os.listdir(os.path.join(input_dir, name)))
+        if file_name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    return classes, files
+
+
+def build_dataset(
+    input_dir: str, output_dir: str, seed: int = None, workers: int = None
+) -> int:
+    seed = cfg.AUGMENT_SEED if seed is None else seed
+    workers = workers or cfg.AUGMENT_WORKERS
+    classes, files = list_files(input_dir)
+    if not files:
+        raise ValueError(f"No images found in the class directories of {input_dir}.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(path, image_seed(seed, path)) for path, _ in files]
+    shape = (header_height(), cfg.IMG_WIDTH)
+    images = None
+    labels = []
+
+    pool = (
+        ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        if workers > 1
+        else nullcontext()
+    )
+    with pool as executor:
+        # Results come back in input order, so the packed dataset does not
+        # depend on the number of workers.
+        results = (
+            executor.map(augment_file, tasks, chunksize=4)
+            if executor
+            else map(augment_file, tasks)
+        )
+        for (_, label), augmented in zip(files, results):
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    os.path.join(output_dir, "images.npy"),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(len(files) * len(augmented), *shape, 1),
+                )
+            start = len(labels)
+            images[start : start + len(augmented), ..., 0] = augmented
+            labels.extend([label] * len(augmented))
+
+    images.flush()
+    np.save(os.path.join(output_dir, "labels.npy"), np.array(labels, np.int32))
+    with open(os.path.join(output_dir, "dataset.json"), "w") as f:
+        json.dump(
+            {
+                "classes": classes,
+                "sources": len(files),
+                "samples": len(labels),
+                "shape": [*shape, 1],
+                "seed": seed,
+            },
+            f,
+            indent=2,
+        )
+    return len(labels)
+
+
+def load_dataset(path: str) -> tuple[np.ndarray, np.ndarray, dict]:
+    with open(os.path.join(path, "dataset.json")) as f:
+        meta = json.load(f)
+    images = np.load(os.path.join(path, "images.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(path, "labels.npy"))
+    return images, labels, meta
+
+
+def split_dataset(
+    meta: dict, validation_split: float = 0.2, seed: int = 42
+) -> tuple[np.ndarray, np.ndarray]:
+    # Splits by source image, so augmented copies of one page never end up in
+    # both the training and the validation set.
+    per_source = meta["samples"] // meta["sources"]
+    sources = np.random.default_rng(seed).permutation(meta["sources"])
+    validation = int(len(sources) * validation_split)
+
+    def samples(indices: np.ndarray) -> np.ndarray:
+        return (indices[:, None] * per_source + np.arange(per_source)).ravel()
+
+    return samples(sources[validation:]), samples(sources[:validation])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Augment class directories of page images into a packed dataset."
+    )
+    parser.add_argument(
+        "input", type=str, help="Directory with one subdirectory of images per class."
+    )
+    parser.add_argument("--output", type=str, default=cfg.DATASET_PATH)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    samples = build_dataset(args.input, args.output, args.seed, args.workers)
+    print(f"Saved {samples} samples to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
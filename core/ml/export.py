@@ -0,0 +1,195 @@
+import argparse
+import os
+import sys
+import time
+from typing import Iterator, List
+
+import numpy as np
+from PIL import Image
+
+from core import cfg
+from core.ml.backends import exported_model_path
+from core.ml.judge import ImageRecognizer
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def load_images(paths: List[str], limit: int = None) -> List[Image.Image]:
+    files = []
+    for path in paths:
+        for root, _, names in os.walk(path):
+            files.extend(
+                os.path.join(root, name)
+                for name in sorted(names)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+    files = sorted(files)[:limit]
+    if not files:
+        raise ValueError(f"No images found in {', '.join(paths)}.")
+    return [Image.open(file).convert("L") for file in files]
+
+
+def calibration_batches(
+    recognizer: ImageRecognizer, images: List[Image.Image], batch_size: int = 1
+) -> Iterator[np.ndarray]:
+    for start in range(0, len(images), batch_size):
+        yield recognizer.preprocess(images[start : start + batch_size])
+
+
+def export_onnx(
+    recognizer: ImageRecognizer, output: str, calibration: List[Image.Image] = None
+) -> None:
+    import tensorflow as tf
+    import tf2onnx
+
+    model = recognizer.backend.model
+    signature = [tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, "input")]
+    float_path = output if calibration is None else f"{output}.float"
+    tf2onnx.convert.from_keras(model, input_signature=signature, output_path=float_path)
+    if calibration is None:
+        return
+
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+
+    class Reader(CalibrationDataReader):
+        def __init__(self) -> None:
+            self.batches = calibration_batches(recognizer, calibration)
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {"input": batch}
+
+    quantize_static(
+        float_path,
+        output,
+        Reader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    os.remove(float_path)
+
+
+def export_tflite(
+    recognizer: ImageRecognizer, output: str, calibration: List[Image.Image] = None
+) -> None:
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(recognizer.backend.model)
+    if calibration is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: (
+            [batch] for batch in calibration_batches(recognizer, calibration)
+        )
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+EXPORTERS = {"onnx": export_onnx, "tflite": export_tflite}
+
+
+def export(args: argparse.Namespace) -> None:
+    recognizer = ImageRecognizer.load_model(args.model, backend="keras")
+    output = args.output or exported_model_path(str(recognizer.model_path), args.format)
+
+    calibration = None
+    if args.quantize:
+        calibration = load_images(
+            args.calibration or [cfg.WZ_IMAGES_DIR_PATH, cfg.NOT_WZ_IMAGES_DIR_PATH],
+            args.calibration_limit,
+        )
+
+    EXPORTERS[args.format](recognizer, output, calibration)
+    print(f"Saved {args.format} model to {output}.")
+
+
+def timed_probabilities(
+    recognizer: ImageRecognizer, images: List[Image.Image], batch_size: int
+) -> tuple[np.ndarray, float]:
+    recognizer._predict(images[:batch_size], batch_size)
+    started = time.perf_counter()
+    probabilities = recognizer._predict(images, batch_size)
+    return np.array(probabilities), time.perf_counter() - started
+
+
+def validate(args: argparse.Namespace) -> None:
+    images = load_images(args.pages)
+    reference = ImageRecognizer.load_model(args.model, backend="keras")
+    candidate = ImageRecognizer.load_model(
+        args.candidate or exported_model_path(str(reference.model_path), args.backend),
+        backend=args.backend,
+    )
+
+    expected, reference_seconds = timed_probabilities(
+        reference, images, args.batch_size
+    )
+    actual, candidate_seconds = timed_probabilities(candidate, images, args.batch_size)
+
+    agreement = float(np.mean((expected >= 0.5) == (actual >= 0.5)))
+    print(
+        f"{args.backend} ({candidate.model_path}) on {len(images)} pages: "
+        f"agreement {agreement:.4f}, "
+        f"max probability difference {np.max(np.abs(expected - actual)):.4f}"
+    )
+    print(
+        f"keras {reference_seconds / len(images) * 1000:.1f} ms/page, "
+        f"{args.backend} {candidate_seconds / len(images) * 1000:.1f} ms/page"
+    )
+
+    if agreement < args.min_agreement:
+        print(f"Agreement is below {args.min_agreement}.")
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export the WZ classifier for CPU inference and validate it."
+    )
+    parser.add_argument("--model", type=str, help="Path of the Keras model.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Convert the Keras model.")
+    export_parser.add_argument("format", choices=list(EXPORTERS))
+    export_parser.add_argument("--output", type=str)
+    export_parser.add_argument(
+        "--quantize", action="store_true", help="Quantize weights and activations."
+    )
+    export_parser.add_argument(
+        "--calibration",
+        type=str,
+        nargs="+",
+        help="Directories with page images used to calibrate the quantization.",
+    )
+    export_parser.add_argument("--calibration-limit", type=int, default=200)
+    export_parser.set_defaults(handler=export)
+
+    validate_parser = commands.add_parser(
+        "validate", help="Compare an exported model with the Keras model."
+    )
+    validate_parser.add_argument("backend", choices=list(EXPORTERS))
+    validate_parser.add_argument("--candidate", type=str, help="Exported model path.")
+    validate_parser.add_argument(
+        "--pages", type=str, nargs="+", required=True, help="Page image directories."
+    )
+    validate_parser.add_argument(
+        "--batch-size", type=int, default=cfg.CLASSIFIER_BATCH_SIZE
+    )
+    validate_parser.add_argument("--min-agreement", type=float, default=0.99)
+    validate_parser.set_defaults(handler=validate)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
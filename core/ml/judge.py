@@ -1,30 +1,57 @@
+import os
+from functools import lru_cache
+from typing import Iterable, List
+
 import numpy as np
-import tensorflow as tf
-from keras.src.saving import load_model
 from PIL import Image
-from tensorflow.keras.layers import (
-    Conv2D,
-    Dense,
-    Dropout,
-    GlobalAveragePooling2D,
-    MaxPooling2D,
-)
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.optimizers import Adam
 
 from core import cfg
+from core.cache import cache, digest
+from core.ml.backends import KerasBackend, exported_model_path, load_backend
 
 
 class ImageRecognizer:
-    def __init__(self, model: str = None):
-        self.model = model
+    def __init__(self, backend=None, model_path: str = None):
+        self.backend = backend
+        self.model_path = model_path
 
     @classmethod
-    def load_model(cls, model_path: str = cfg.MODEL_PATH) -> "ImageRecognizer":
-        model = load_model(model_path)
-        return cls(model)
+    def load_model(
+        cls, model_path: str = None, backend: str = None, threads: int = None
+    ) -> "ImageRecognizer":
+        backend = backend or cfg.CLASSIFIER_BACKEND
+        if model_path is None and backend == "keras":
+            model_path = cfg.MODEL_PATH
+        elif model_path is None:
+            model_path = cfg.CLASSIFIER_MODEL_PATH or exported_model_path(
+                str(cfg.MODEL_PATH), backend
+            )
+        return cls(load_backend(backend, model_path, threads), model_path)
+
+    @property
+    def cache_params(self) -> dict:
+        mtime = None
+        if self.model_path and os.path.exists(self.model_path):
+            mtime = os.path.getmtime(self.model_path)
+        return {
+            "model": str(self.model_path),
+            "mtime": mtime,
+            "backend": getattr(self.backend, "name", None),
+        }
+
+    def build(self, dataset: str = None):
+        # Training is the only place that needs the full TensorFlow stack.
+        import tensorflow as tf
+        from tensorflow.keras.layers import (
+            Conv2D,
+            Dense,
+            Dropout,
+            GlobalAveragePooling2D,
+            MaxPooling2D,
+        )
+        from tensorflow.keras.models import Sequential
+        from tensorflow.keras.optimizers import Adam
 
-    def build(self):
         batch_size = 8
         channel = 1
         cropped_height = cfg.IMG_HEIGHT // 4
@@ -34,35 +61,41 @@ class ImageRecognizer:
                 image, 0, 0, cropped_height, cfg.IMG_WIDTH
             ), label
 
-        train_ds = tf.keras.utils.image_dataset_from_directory(
-            cfg.IMAGES_DIR,
-            image_size=(cfg.IMG_HEIGHT, cfg.IMG_WIDTH),
-            color_mode="grayscale",
-            batch_size=batch_size,
-            shuffle=True,
-            seed=42,
-            validation_split=0.2,
-            subset="training",
-        )
+        AUTOTUNE = tf.data.AUTOTUNE
 
-        val_ds = tf.keras.utils.image_dataset_from_directory(
-            cfg.IMAGES_DIR,
-            image_size=(cfg.IMG_HEIGHT, cfg.IMG_WIDTH),
-            color_mode="grayscale",
-            batch_size=batch_size,
-            shuffle=True,
-            seed=42,
-            validation_split=0.2,
-            subset="validation",
-        )
+        if dataset:
+            train_ds, val_ds = self._packed_datasets(dataset, batch_size)
+        else:
+            train_ds = tf.keras.utils.image_dataset_from_directory(
+                cfg.IMAGES_DIR,
+                image_size=(cfg.IMG_HEIGHT, cfg.IMG_WIDTH),
+                color_mode="grayscale",
+                batch_size=batch_size,
+                shuffle=True,
+                seed=42,
+                validation_split=0.2,
+                subset="training",
+            )
 
-        AUTOTUNE = tf.data.AUTOTUNE
+            val_ds = tf.keras.utils.image_dataset_from_directory(
+                cfg.IMAGES_DIR,
+                image_size=(cfg.IMG_HEIGHT, cfg.IMG_WIDTH),
+                color_mode="grayscale",
+                batch_size=batch_size,
+                shuffle=True,
+                seed=42,
+                validation_split=0.2,
+                subset="validation",
+            )
+
+            train_ds = train_ds.map(crop_header, num_parallel_calls=AUTOTUNE)
+            val_ds = val_ds.map(crop_header, num_parallel_calls=AUTOTUNE)
 
-        train_ds = train_ds.map(crop_header, num_parallel_calls=AUTOTUNE)
-        val_ds = val_ds.map(crop_header, num_parallel_calls=AUTOTUNE)
+            train_ds = train_ds.cache()
+            val_ds = val_ds.cache()
 
-        train_ds = train_ds.cache().prefetch(buffer_size=AUTOTUNE)
-        val_ds = val_ds.cache().prefetch(buffer_size=AUTOTUNE)
+        train_ds = train_ds.prefetch(buffer_size=AUTOTUNE)
+        val_ds = val_ds.prefetch(buffer_size=AUTOTUNE)
 
         model = Sequential([
             Conv2D(
@@ -103,36 +136,179 @@ class ImageRecognizer:
             ],
         )
 
-        self.model = model
+        self.backend = KerasBackend(model)
+
+    @staticmethod
+    def _packed_datasets(path: str, batch_size: int) -> tuple:
+        import tensorflow as tf
+
+        from core.ml.dataset import load_dataset, split_dataset
 
-    def recognize(self, img: Image):
-        if self.model.input_shape[-1] == 1:
-            img = img.convert("L")
+        images, labels, meta = load_dataset(path)
+        train, validation = split_dataset(meta)
+        rng = np.random.default_rng(42)
 
-        width, height = img.size
-        cropped_height = height // 4
-        img = img.crop((0, 0, width, cropped_height))
+        def batches(indices: np.ndarray):
+            for start in range(0, len(indices), batch_size):
+                # Sorted reads keep the memory-mapped file access sequential.
+                batch = np.sort(indices[start : start + batch_size])
+                yield images[batch].astype(np.float32), labels[batch]
+
+        signature = (
+            tf.TensorSpec((None, *images.shape[1:]), tf.float32),
+            tf.TensorSpec((None,), tf.int32),
+        )
+        train_ds = tf.data.Dataset.from_generator(
+            lambda: batches(rng.permutation(train)), output_signature=signature
+        )
+        val_ds = tf.data.Dataset.from_generator(
+            lambda: batches(validation), output_signature=signature
+        )
+        return train_ds, val_ds
 
-        img = img.resize((self.model.input_shape[2], self.model.input_shape[1]))
+    def recognize(self, img: Image) -> dict:
+        return self.recognize_batch([img], batch_size=1)[0]
 
-        img_array = tf.keras.preprocessing.image.img_to_array(img) / 255.0
+    def recognize_batch(
+        self,
+        images: Iterable[Image.Image | np.ndarray],
+        batch_size: int = None,
+        digests: List[str] = None,
+    ) -> List[dict]:
+        images = list(images)
+        probabilities: List[float | None] = [None] * len(images)
+        keys: List[str] = []
 
-        if len(img_array.shape) == 2:
-            img_array = np.expand_dims(img_array, axis=-1)
-        img_array = np.expand_dims(img_array, axis=0)
+        if cache.enabled:
+            params = self.cache_params
+            digests = digests or [digest(np.asarray(img)) for img in images]
+            keys = [cache.key("classifier", params, page) for page in digests]
+            probabilities = [cache.get(key) for key in keys]
 
-        prediction = self.model.predict(img_array)
-        probability = prediction[0][0]
+        missing = [
+            i for i, probability in enumerate(probabilities) if probability is None
+        ]
+        if missing:
+            predicted = self._predict([images[i] for i in missing], batch_size)
+            for i, probability in zip(missing, predicted):
+                probabilities[i] = float(probability)
+                if keys:
+                    cache.set(keys[i], probabilities[i])
 
+        return [self._result(probability) for probability in probabilities]
+
+    def _predict(
+        self, images: List[Image.Image | np.ndarray], batch_size: int = None
+    ) -> List[float]:
+        batch_size = batch_size or cfg.CLASSIFIER_BATCH_SIZE
+        inputs = self.preprocess(images, batch_size)
+
+        probabilities = []
+        for start in range(0, len(inputs), batch_size):
+            batch = inputs[start : start + batch_size]
+            size = len(batch)
+            if size < batch_size:
+                padding = np.zeros((batch_size - size, *batch.shape[1:]), batch.dtype)
+                batch = np.concatenate([batch, padding])
+            probabilities.extend(self.backend.predict(batch)[:size])
+
+        return probabilities
+
+    def preprocess(
+        self, images: Iterable[Image.Image | np.ndarray], batch_size: int = None
+    ) -> np.ndarray:
+        batch_size = batch_size or cfg.CLASSIFIER_BATCH_SIZE
+        _, height, width, channels = self.backend.input_shape
+        images = list(images)
+        inputs = np.empty((len(images), height, width, channels), np.float32)
+
+        by_size: dict[tuple, list[int]] = {}
+        for i, img in enumerate(images):
+            size = img.size[::-1] if isinstance(img, Image.Image) else np.shape(img)[:2]
+            by_size.setdefault(tuple(size), []).append(i)
+
+        for (page_height, page_width), indices in by_size.items():
+            rows = _resample_matrix(page_height // 4, height)
+            cols = _resample_matrix(page_width, width)
+            # Only a batch of headers is converted to float at a time.
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start : start + batch_size]
+                stack = np.stack([self._to_array(images[i], channels) for i in chunk])
+                resized = np.einsum(
+                    "hy,nyxc,wx->nhwc",
+                    rows,
+                    stack.astype(np.float32, copy=False),
+                    cols,
+                    optimize=True,
+                )
+                inputs[chunk] = np.clip(np.rint(resized), 0, 255) / 255.0
+
+        return inputs
+
+    @staticmethod
+    def _to_array(img: Image.Image | np.ndarray, channels: int) -> np.ndarray:
+        # The classifier only sees the top quarter of the page, so it is cut
+        # before the page is copied or converted.
+        if isinstance(img, Image.Image):
+            array = np.asarray(img.crop((0, 0, img.width, img.height // 4)))
+        else:
+            array = np.asarray(img)
+            array = array[: array.shape[0] // 4]
+        if array.ndim == 3 and array.shape[-1] == 4:
+            array = array[..., :3]
+
+        if channels == 1:
+            if array.ndim == 3:
+                # Same ITU-R 601-2 luma transform as PIL's convert("L").
+                array = array.astype(np.float32) @ np.array(
+                    [0.299, 0.587, 0.114], np.float32
+                )
+            return array[..., np.newaxis]
+
+        if array.ndim == 2:
+            array = np.repeat(array[..., np.newaxis], 3, axis=-1)
+        return array
+
+    @staticmethod
+    def _result(probability: float) -> dict:
         threshold = 0.5
-        result = {
+        return {
             "is_wz": probability >= threshold,
             "confidence": probability if probability >= threshold else 1 - probability,
             "class": "WZ" if probability >= threshold else "NO_WZ",
         }
 
-        return result
+
+@lru_cache(maxsize=16)
+def _resample_matrix(in_size: int, out_size: int) -> np.ndarray:
+    # Bicubic weights with PIL's support scaling, so batched resizing matches
+    # Image.resize() closely while running as a single matrix product.
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    support = 2.0 * filter_scale
+
+    centers = (np.arange(out_size) + 0.5) * scale
+    lower = np.maximum((centers - support + 0.5).astype(int), 0)
+    upper = np.minimum((centers + support + 0.5).astype(int), in_size)
+
+    positions = np.arange(in_size)
+    x = np.abs((positions[None, :] - centers[:, None] + 0.5) / filter_scale)
+    a = -0.5
+    weights = np.where(
+        x < 1.0,
+        ((a + 2.0) * x - (a + 3.0)) * x * x + 1.0,
+        np.where(x < 2.0, (((x - 5.0) * x + 8.0) * x - 4.0) * a, 0.0),
+    )
+    window = (positions[None, :] >= lower[:, None]) & (
+        positions[None, :] < upper[:, None]
+    )
+    weights = np.where(window, weights, 0.0)
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    return weights.astype(np.float32)
 
 
 if __name__ == "__main__":
-    ImageRecognizer().build()
+    ImageRecognizer().build(
+        cfg.DATASET_PATH if os.path.exists(cfg.DATASET_PATH) else None
+    )
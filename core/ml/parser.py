@@ -1,26 +1,34 @@
+import hashlib
 import os
 import random
 import string
-from typing import Optional
+from typing import Iterator, Optional
 
 import cv2
 import numpy as np
-from ml import IMG_HEIGHT, IMG_WIDTH
 from PIL import Image, ImageEnhance
 
 from core import cfg
 
 
-class ImageParser:
-    previous_angle = 2
-    previous_brightness_factor_index = 0
-    previous_contrast_factor_index = 0
+def image_seed(seed: int, path: str) -> int:
+    # Stable across processes and runs, unlike hash().
+    key = f"{seed}:{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}"
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
 
-    def __init__(self, image_array: np.ndarray, path: str):
+class ImageParser:
+    def __init__(self, image_array: np.ndarray, path: str, seed: int = None):
         self.original_image_array = image_array
         self.image_array = self.original_image_array.copy()
         self.path = path
         self.class_name = os.path.basename(os.path.dirname(self.path))
+        # Alternation state and noise are per image, so images can be
+        # augmented in any order or process with the same result.
+        self.rng = np.random.default_rng(seed)
+        self.previous_angle = 2
+        self.previous_brightness_factor_index = 0
+        self.previous_contrast_factor_index = 0
 
     def reset_image(self):
         self.image_array = self.original_image_array.copy()
@@ -95,12 +103,20 @@ class ImageParser:
         )
 
     @classmethod
-    def read_image(cls, image_path: str):
+    def read_image(cls, image_path: str, seed: int = None):
         image_array = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        return cls(image_array, image_path)
+        return cls(image_array, image_path, seed)
+
+    def augmentations(self) -> Iterator[np.ndarray]:
+        for operation_set in self.operations:
+            for operation in operation_set:
+                operation()
+
+            yield self.image_array
+            self.reset_image()
 
     def resize(self):
-        self.image_array = cv2.resize(self.image_array, (IMG_WIDTH, IMG_HEIGHT))
+        self.image_array = cv2.resize(self.image_array, (cfg.IMG_WIDTH, cfg.IMG_HEIGHT))
 
     def blur_image(self):
         self.image_array = cv2.GaussianBlur(self.image_array, (1, 1), 0)
@@ -108,7 +124,7 @@ class ImageParser:
 
     def add_gaussian_noise(self) -> np.ndarray:
         sigma = 0.01**0.5
-        gaussian = np.random.normal(0, sigma, self.image_array.shape).astype(np.float32)
+        gaussian = self.rng.normal(0, sigma, self.image_array.shape).astype(np.float32)
         self.image_array = self.image_array.astype(np.float32)
         self.image_array = cv2.addWeighted(self.image_array, 0.75, gaussian, 0.25, 0)
         self.image_array = np.clip(self.image_array, 0, 255).astype(np.uint8)
@@ -156,21 +172,18 @@ class ImageParser:
         self.previous_angle *= -1
 
     @classmethod
-    def process_images_in_directory(cls, directory_path: str):
+    def process_images_in_directory(cls, directory_path: str, seed: int = None):
         """Przetwarza i augmentuje obrazy z katalogu wejściowego"""
         counter = 1
+        seed = cfg.AUGMENT_SEED if seed is None else seed
 
-        for filename in os.listdir(directory_path):
+        for filename in sorted(os.listdir(directory_path)):
             if filename.lower().endswith(".png"):
                 input_path = os.path.join(directory_path, filename)
-                image_parser = cls.read_image(input_path)
-
-                for operation_set in image_parser.operations:
-                    for operation in operation_set:
-                        operation()
+                image_parser = cls.read_image(input_path, image_seed(seed, input_path))
 
+                for _ in image_parser.augmentations():
                     image_parser.save_as_new(f"{image_parser.class_name}_{counter}.png")
-                    image_parser.reset_image()
                     counter += 1
 
                 os.remove(input_path)
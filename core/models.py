@@ -0,0 +1,58 @@
+from threading import RLock
+
+import numpy as np
+
+from core import cfg
+from core.resources import governor
+
+
+class ModelRegistry:
+    def __init__(self) -> None:
+        self._lock = RLock()
+        self._gpu_configured = False
+        self._recognizer = None
+        self._reader = None
+
+    def _configure_gpu(self) -> None:
+        if not self._gpu_configured:
+            cfg.configure_gpu()
+            self._gpu_configured = True
+
+    @property
+    def recognizer(self):
+        if self._recognizer is None:
+            with self._lock:
+                if self._recognizer is None:
+                    from core.ml.judge import ImageRecognizer
+
+                    self._configure_gpu()
+                    self._recognizer = ImageRecognizer.load_model(
+                        threads=governor.plan["classifier"]
+                    )
+        return self._recognizer
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            with self._lock:
+                if self._reader is None:
+                    from easyocr import Reader
+
+                    self._configure_gpu()
+                    governor.configure_torch()
+                    self._reader = Reader(["en", "pl"], gpu=cfg.GPU_ENABLED)
+        return self._reader
+
+    def load(self) -> None:
+        self.recognizer
+        self.reader
+
+    def warm_up(self) -> None:
+        # Runs both models once on blank input so graph tracing and kernel
+        # selection happen before the first real page arrives.
+        blank_page = np.full((cfg.IMG_HEIGHT, cfg.IMG_WIDTH), 255, np.uint8)
+        self.recognizer.recognize_batch([blank_page])
+        self.reader.readtext(blank_page[:64, :256])
+
+
+models = ModelRegistry()
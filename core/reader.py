@@ -1,61 +1,397 @@
+import logging
+import math
 import os
 import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from shutil import move
-from typing import List, Optional
+from io import BytesIO
+from itertools import groupby
+from shutil import copyfile, move
+from typing import Callable, Iterator, List, Optional
 
 import numpy as np
 import pytesseract
-from easyocr import Reader
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 
 from core import cfg
-from core.ml.judge import ImageRecognizer
+from core.cache import cache, digest
+from core.duplicates import duplicates, page_hashes
+from core.fallback import easyocr_lock, fallback
+from core.journal import PageJournal, file_digest
+from core.layouts import fingerprint, layouts
+from core.matching import best_match
+from core.metrics import metrics
+from core.models import models
+from core.resources import governor
+from core.strategies import strategies
+from core.tracing import tracer
 
 if cfg.TESSERACT_CMD:
     pytesseract.pytesseract.tesseract_cmd = cfg.TESSERACT_CMD
 
+# Tesseract takes its thread limit only from the environment, and pytesseract
+# has no option for it, so the private helper building its subprocess
+# arguments is wrapped. Without the helper Tesseract runs unlimited.
+_tesseract_subprocess_args = getattr(pytesseract.pytesseract, "subprocess_args", None)
+
+
+def tesseract_subprocess_args(*args, **kwargs) -> dict:
+    return {
+        **_tesseract_subprocess_args(*args, **kwargs),
+        "env": governor.tesseract_env(),
+    }
+
+
+if _tesseract_subprocess_args is None:
+    logging.warning(
+        "pytesseract.pytesseract.subprocess_args is missing, "
+        "Tesseract threads are not limited"
+    )
+else:
+    pytesseract.pytesseract.subprocess_args = tesseract_subprocess_args
+
 poppler_path = cfg.POPPLER_PATH
-recognizer = ImageRecognizer.load_model()
-reader = Reader(["en", "pl"], gpu=cfg.GPU_ENABLED)
+
+
+def poppler_command(name: str) -> str:
+    return os.path.join(poppler_path, name) if poppler_path else name
+
+
+WZ_PATTERN = r"(WZK|WZ-\d+/\d+/[A-Z]+/\d+)"
+HEADER_BAND = 0.3
+# Pages converted to PIL images at once while writing a raster WZ file.
+SAVE_CHUNK = 8
+
+
+def find_number(content: str) -> Optional[str]:
+    wz_match = re.search(WZ_PATTERN, content)
+    strict = wz_match.group(1) if wz_match else None
+
+    # Accepting a confidently corrected number stops the OCR cascade early
+    # instead of running further passes over a misread. It also replaces a
+    # strict match cut short by a misread character, e.g. "WZ-1/05/ABC/2O24".
+    if cfg.WZ_FUZZY_MATCH and (match := best_match(content)):
+        number, confidence = match
+        if (
+            confidence >= cfg.WZ_MATCH_MIN_CONFIDENCE
+            and number != strict
+            and (strict is None or number.startswith(strict))
+        ):
+            metrics.increment("wz_fuzzy_match")
+            return number
+    return strict
 
 
 class PdfImage:
-    def __init__(self, image: Image) -> None:
+    # One pixel buffer per page: _page holds the rendered page (in memory or
+    # memory-mapped after a spill) and _image is a view of it, or the separately
+    # rendered header band.
+    __slots__ = (
+        "page_number",
+        "text",
+        "dpi",
+        "_page",
+        "_image",
+        "_cut",
+        "_digest",
+        "_page_digest",
+    )
+
+    def __init__(
+        self,
+        image: Optional[Image.Image | np.ndarray],
+        page_number: int = None,
+        text: str = None,
+        dpi: int = None,
+    ) -> None:
+        self.page_number = page_number
+        self.text = text
+        self.dpi = dpi or cfg.RASTER_DPI
+        self._digest: Optional[str] = None
+        self._page_digest: Optional[str] = None
         self.raw = image
-        self._image = np.array(image)
+
+    @property
+    def raw(self) -> Optional[Image]:
+        # PIL only shares the buffer of greyscale arrays; colour pages are
+        # copied on every access.
+        return None if self._page is None else Image.fromarray(self._page)
+
+    @raw.setter
+    def raw(self, image: Optional[Image.Image | np.ndarray]) -> None:
+        self._page = None if image is None else np.asarray(image)
+        self._image = self._page
+        self._cut = False
 
     @property
     def obj(self) -> Image:
         return Image.fromarray(self._image)
 
-    def get_content(self, psm: int = 6, oem: int = 3) -> str:
+    @property
+    def size(self) -> tuple[int, int]:
+        height, width = self._page.shape[:2]
+        return width, height
+
+    @property
+    def rendered(self) -> bool:
+        return self._page is not None
+
+    def get_page_digest(self) -> str:
+        if self._page_digest is None:
+            self._page_digest = digest(self._page)
+        return self._page_digest
+
+    def get_digest(self) -> str:
+        if not self._cut:
+            return self.get_page_digest()
+        if self._digest is None:
+            self._digest = digest(self._image)
+        return self._digest
+
+    @staticmethod
+    def _tesseract_config(psm: int, oem: int) -> str:
         allowed_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZK0123456789/-"
+        return f"--psm {psm} --oem {oem} -c tessedit_char_whitelist={allowed_chars}"
+
+    def get_content(self, psm: int = 6, oem: int = 3) -> str:
+        config = self._tesseract_config(psm, oem)
+
+        def read_text() -> str:
+            with metrics.stage("tesseract"):
+                return pytesseract.image_to_string(
+                    self._image,
+                    lang="eng",
+                    config=config,
+                ).replace("\n", " ")
+
+        with tracer.span(
+            "get_content", page=self.page_number, psm=psm, oem=oem, cut=self._cut
+        ):
+            return cache.memoize(
+                "tesseract",
+                {"lang": "eng", "config": config},
+                self.get_digest,
+                read_text,
+            )
+
+    def _page_height(self) -> float:
+        height = self._image.shape[0]
+        return height / HEADER_BAND if self._cut else height
+
+    def get_region_content(self, box: tuple) -> Optional[str]:
+        height, width = self._image.shape[:2]
+        page_height = self._page_height()
+        x0, y0, x1, y1 = box
+        if math.ceil(y1 * page_height) > height:
+            return None
+
+        config = self._tesseract_config(7, 3)
+        region = self._image[
+            int(y0 * page_height) : math.ceil(y1 * page_height),
+            int(x0 * width) : math.ceil(x1 * width),
+        ]
+
+        def read_text() -> str:
+            with metrics.stage("tesseract_region"):
+                return pytesseract.image_to_string(
+                    region, lang="eng", config=config
+                ).replace("\n", " ")
+
+        with tracer.span("get_region_content", page=self.page_number):
+            return cache.memoize(
+                "tesseract_region",
+                {"lang": "eng", "config": config, "box": box},
+                self.get_digest,
+                read_text,
+            )
+
+    def locate(self, number: str) -> Optional[tuple]:
+        # Box of the WZ number relative to the whole page, so it can be reused at
+        # any DPI and on the header band alone.
+        with metrics.stage("tesseract_boxes"):
+            data = pytesseract.image_to_data(
+                self._image,
+                lang="eng",
+                config="--psm 11",
+                output_type=pytesseract.Output.DICT,
+            )
+
+        lines: dict[tuple, list[int]] = {}
+        for i, word in enumerate(data["text"]):
+            word = word.strip()
+            if word and (word in number or number in word):
+                line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+                lines.setdefault(line, []).append(i)
+
+        anchors = [
+            words
+            for words in lines.values()
+            if any("WZ" in data["text"][i] for i in words)
+        ]
+        if not anchors:
+            return None
+
+        words = max(anchors, key=len)
+        x0 = min(data["left"][i] for i in words)
+        y0 = min(data["top"][i] for i in words)
+        x1 = max(data["left"][i] + data["width"][i] for i in words)
+        y1 = max(data["top"][i] + data["height"][i] for i in words)
+        padding = y1 - y0
+
+        width, page_height = self._image.shape[1], self._page_height()
+        return (
+            max(0.0, (x0 - padding) / width),
+            max(0.0, (y0 - padding) / page_height),
+            min(1.0, (x1 + padding) / width),
+            min(1.0, (y1 + padding) / page_height),
+        )
 
-        return pytesseract.image_to_string(
-            self._image,
-            lang="eng",
-            config=f"--psm {psm} --oem {oem} -c tessedit_char_whitelist={allowed_chars}",
-        ).replace("\n", " ")
-
-    def is_page_empty(self) -> bool:
-        raw_image = np.array(self.raw)
-        content = pytesseract.image_to_string(
-            raw_image,
-            lang="eng",
+    def get_easyocr_content(self) -> str:
+        params = {
+            "decoder": "beamsearch",
+            "text_threshold": 0.8,
+            "low_text": 0.3,
+            "contrast_ths": 0.2,
+            "adjust_contrast": 0.7,
+            "canvas_size": 4096,
+        }
+
+        def read_text() -> str:
+            with (
+                easyocr_lock,
+                metrics.stage("easyocr"),
+                tracer.span("reader.readtext", page=self.page_number),
+            ):
+                content = models.reader.readtext(self._image, **params)
+            return " ".join([phrase for _, phrase, _ in content])
+
+        return cache.memoize(
+            "easyocr", {"lang": ["en", "pl"], **params}, self.get_digest, read_text
+        )
+
+    def ink_density(self) -> float:
+        with metrics.stage("empty_ink"):
+            return self._ink_density()
+
+    def _ink_density(self) -> float:
+        page = self._page
+        if page.ndim == 3:
+            page = page[..., :3].mean(axis=-1)
+
+        # Min-pooled downsampling keeps thin strokes; the page margins, where scanners
+        # tend to leave dark borders, are skipped.
+        scale = max(1, round(cfg.EMPTY_PAGE_DOWNSCALE * self.dpi / cfg.RASTER_DPI))
+        height, width = page.shape
+        margin_y, margin_x = int(height * 0.05), int(width * 0.05)
+        page = page[margin_y : height - margin_y, margin_x : width - margin_x]
+        height, width = (
+            (page.shape[0] // scale) * scale,
+            (page.shape[1] // scale) * scale,
+        )
+        blocks = page[:height, :width].reshape(
+            height // scale, scale, width // scale, scale
         )
+        dark = blocks.min(axis=(1, 3)) < cfg.EMPTY_INK_THRESHOLD
+
+        # Isolated dark cells are scan speckles rather than strokes.
+        padded = np.pad(dark, 1)
+        neighbours = sum(
+            padded[1 + dy : padded.shape[0] - 1 + dy, 1 + dx : padded.shape[1] - 1 + dx]
+            for dy in (-1, 0, 1)
+            for dx in (-1, 0, 1)
+            if dy or dx
+        )
+
+        return float((dark & (neighbours > 0)).mean())
+
+    def is_page_empty(self, render: Callable[[], Image] = None) -> bool:
+        with tracer.span("is_page_empty", page=self.page_number):
+            if cfg.EMPTY_PAGE_METHOD == "ink":
+                density = self.ink_density()
+                if density <= cfg.EMPTY_INK_LOW:
+                    return True
+                if density >= cfg.EMPTY_INK_HIGH:
+                    return False
+
+            return self.is_text_empty(render)
+
+    def is_text_empty(self, render: Callable[[], Image] = None) -> bool:
+        def read_text() -> bool:
+            page = np.asarray(render()) if render else self._page
+            with metrics.stage("empty_ocr"):
+                content = pytesseract.image_to_string(
+                    page,
+                    lang="eng",
+                )
 
-        return len(content) < 100
+            return len(content) < 100
+
+        return cache.memoize("empty", {"lang": "eng"}, self.get_page_digest, read_text)
+
+    @property
+    def is_cut(self) -> bool:
+        return self._cut
 
     def cut(self) -> None:
+        if self._cut:
+            return
+        if cache.enabled:
+            self.get_page_digest()
         height, width = self._image.shape[:2]
-        self._image = self._image[: int(height * 0.3) :]
+        self._image = self._image[: int(height * HEADER_BAND) :]
+        self._cut = True
+        self._digest = None
+
+    def header(self) -> "PdfImage":
+        # A cut view of the page that shares its pixels, so page and header
+        # OCR steps can run side by side.
+        if self._cut:
+            return self
+        header = PdfImage(self._page, self.page_number, dpi=self.dpi)
+        header._page_digest = self._page_digest
+        header.cut()
+        self._page_digest = header._page_digest
+        return header
+
+    def set_header(self, header: Image) -> None:
+        # Replaces the page with its header band rendered at a higher DPI.
+        if cache.enabled:
+            self.get_page_digest()
+        self._image = np.asarray(header)
+        self._cut = True
+        self._digest = None
+
+    def spill(self, directory: str) -> None:
+        # Moves the page to a memory-mapped file; the OS can then drop it from
+        # memory until it is saved. Only the full page is kept.
+        if self._page is None or isinstance(self._page, np.memmap):
+            return
+        if cache.enabled:
+            self.get_page_digest()
+
+        path = os.path.join(directory, f"page-{self.page_number}.npy")
+        np.save(path, self._page)
+        self._page = np.load(path, mmap_mode="r")
+        self._image = self._page
+        self._cut = False
+        self._digest = None
+
+    def release(self) -> None:
+        self.raw = None
+
+    @staticmethod
+    def to_bilevel(image: Image) -> Image:
+        threshold = cfg.BILEVEL_THRESHOLD
+        return image.convert("L").point(lambda v: 255 if v > threshold else 0, "1")
 
     def save(self, *args, **kwargs):
         append_images = kwargs.pop("append_images", [])
-        kwargs["append_images"] = [img.raw for img in append_images]
-        return self.raw.save(*args, **kwargs)
+        convert = self.to_bilevel if kwargs.pop("bilevel", False) else lambda img: img
+        kwargs["append_images"] = [convert(img.raw) for img in append_images]
+        return convert(self.raw).save(*args, **kwargs)
 
 
 class PdfFileProcessor:
@@ -63,16 +399,61 @@ class PdfFileProcessor:
         self,
         file_path: str,
         output_dir: str = None,
+        page_window: int = None,
+        memory_limit: int = None,
+        ocr_workers: int = None,
+        text_layer: bool = None,
+        output_mode: str = None,
+        bilevel: bool = None,
+        classify_dpi: int = None,
+        spill: bool = None,
+        journal: bool = None,
+        duplicates: str = None,
+        final_output_dir: str = None,
+        source_name: str = None,
     ) -> None:
         self.file_path: str = file_path
+        # Spool workers write to a staging directory and process a renamed
+        # lease of the source file.
+        self.source_name: str = source_name or os.path.basename(file_path)
 
         if not os.path.exists(self.file_path):
             raise FileNotFoundError(f"File {self.file_path} not found")
 
         self.output_dir: str = self._ensure_dir_exists(output_dir)
+        self.final_output_dir: str = self._ensure_dir_exists(
+            final_output_dir or self.output_dir
+        )
         self.done_dir: str = self._ensure_dir_exists(self.done_dir_path)
+        self.page_window: int = cfg.PAGE_WINDOW if page_window is None else page_window
+        self.memory_limit: int = (
+            cfg.PAGE_MEMORY_LIMIT_MB if memory_limit is None else memory_limit
+        )
+        self.ocr_workers: int = ocr_workers or governor.page_threads
+        self.text_layer: bool = cfg.TEXT_LAYER if text_layer is None else text_layer
+        self.output_mode: str = output_mode or cfg.OUTPUT_MODE
+        self.bilevel: bool = cfg.RASTER_BILEVEL if bilevel is None else bilevel
+        self.classify_dpi: int = (
+            cfg.CLASSIFY_DPI if classify_dpi is None else classify_dpi
+        )
+        self.spill: bool = cfg.PAGE_SPILL if spill is None else spill
+        self.journaling: bool = cfg.JOURNAL if journal is None else journal
+        self.journal: Optional[PageJournal] = None
+        self.duplicate_mode: str = duplicates or cfg.DUPLICATES
+        self._digest: Optional[str] = None
+        self._known: dict[int, tuple[str, Optional[str], bool]] = {}
+        self._hashes: dict[int, tuple[int, int]] = {}
+        self._linked: dict[int, dict] = {}
+        self._linked_numbers: dict[int, Optional[str]] = {}
+        self._skipped: set[str] = set()
+        self._written: set[int] = set()
+        self._spill_dir: Optional[tempfile.TemporaryDirectory] = None
+        self.pages_count: int = 0
         self._images: List[PdfImage] = []
-        self._wz_aggregation: dict[str, list[Image]] = {}
+        self._text_pages: dict[int, str] = {}
+        self._wz_aggregation: dict[str, list[PdfImage]] = {}
+        self._wz_number: Optional[str] = None
+        self.groups: dict[str, list[int]] = {}
         self._processed: bool = False
 
     def _ensure_dir_exists(self, dir_path: str = None) -> str:
@@ -84,90 +465,646 @@ class PdfFileProcessor:
         done_dir_name = datetime.now().strftime("%d-%m-%Y")
         return os.path.join(self.output_dir, done_dir_name)
 
-    def _split_file(self) -> None:
-        self._images = [
-            PdfImage(img)
-            for img in convert_from_path(
+    @property
+    def wz_count(self) -> int:
+        return len(self.groups)
+
+    @property
+    def streaming(self) -> bool:
+        return bool(self.page_window or self.memory_limit)
+
+    @property
+    def spill_dir(self) -> str:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(
+                prefix="wz_conv-", dir=cfg.SPILL_DIR
+            )
+        return self._spill_dir.name
+
+    @property
+    def two_pass(self) -> bool:
+        return 0 < self.classify_dpi < cfg.RASTER_DPI
+
+    @property
+    def load_dpi(self) -> int:
+        return self.classify_dpi if self.two_pass else cfg.RASTER_DPI
+
+    def _page_bytes(self, info: dict) -> int:
+        # Every page is held as a single RGB array.
+        width, height = 595.0, 842.0
+        if size := re.match(r"([\d.]+) x ([\d.]+)", str(info.get("Page size", ""))):
+            width, height = float(size.group(1)), float(size.group(2))
+
+        scale = self.load_dpi / 72
+        return int(width * scale) * int(height * scale) * 3
+
+    def _window_size(self, info: dict) -> int:
+        window = self.page_window or self.pages_count
+
+        if self.memory_limit:
+            limit = self.memory_limit * 1024 * 1024
+            window = min(window, max(1, limit // self._page_bytes(info)))
+
+        return max(1, window)
+
+    def _render(self, first_page: int, last_page: int, dpi: int = None) -> List[Image]:
+        with metrics.stage("rasterize"):
+            images = convert_from_path(
                 self.file_path,
                 poppler_path=poppler_path,
-                dpi=200,
-                thread_count=4,
+                dpi=dpi or cfg.RASTER_DPI,
+                thread_count=governor.raster_threads,
                 fmt="png",
+                first_page=first_page,
+                last_page=last_page,
+            )
+
+        metrics.increment("pages_rasterized", len(images))
+        return images
+
+    def _render_page(self, page_number: int) -> Image:
+        return self._render(page_number, page_number)[0]
+
+    def _render_header(self, image: PdfImage) -> Image:
+        # pdftoppm crops while rendering, so only the header band is ever
+        # rasterized at full DPI.
+        width, height = image.size
+        scale = cfg.RASTER_DPI / image.dpi
+        with metrics.stage("rasterize_header"):
+            result = subprocess.run(
+                [
+                    poppler_command("pdftoppm"),
+                    "-r",
+                    str(cfg.RASTER_DPI),
+                    "-f",
+                    str(image.page_number),
+                    "-l",
+                    str(image.page_number),
+                    "-x",
+                    "0",
+                    "-y",
+                    "0",
+                    "-W",
+                    str(round(width * scale)),
+                    "-H",
+                    str(int(round(height * scale) * HEADER_BAND)),
+                    "-png",
+                    self.file_path,
+                ],
+                capture_output=True,
+                check=True,
+            )
+
+        metrics.increment("headers_rasterized")
+        return Image.open(BytesIO(result.stdout)).convert("RGB")
+
+    @staticmethod
+    def _page_runs(page_numbers: List[int]) -> Iterator[tuple[int, int]]:
+        for _, run in groupby(enumerate(page_numbers), lambda item: item[1] - item[0]):
+            run = [page_number for _, page_number in run]
+            yield run[0], run[-1]
+
+    def _read_text_layer(self) -> dict[int, str]:
+        try:
+            with metrics.stage("text_layer"), tracer.span("_read_text_layer"):
+                result = subprocess.run(
+                    [
+                        poppler_command("pdftotext"),
+                        "-layout",
+                        "-enc",
+                        "UTF-8",
+                        self.file_path,
+                        "-",
+                    ],
+                    capture_output=True,
+                    check=True,
+                )
+        except (OSError, subprocess.CalledProcessError):
+            return {}
+
+        pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+        text_pages = {}
+
+        # Only pages naming a WZ number are resolved by their text layer. A
+        # WZ header whose number is missing from a poor or partial text layer
+        # could still be read from the rendered page, so all other pages go
+        # through the classifier and OCR.
+        for page_number, text in enumerate(pages[: self.pages_count], start=1):
+            if find_number(text):
+                text_pages[page_number] = text
+
+        metrics.increment("pages_text_layer", len(text_pages))
+        return text_pages
+
+    def _split_file(self, first_page: int = 1, last_page: int = None) -> None:
+        last_page = last_page or self.pages_count
+        with tracer.span("_split_file", first_page=first_page, last_page=last_page):
+            self._images = self._load_pages(first_page, last_page)
+
+    def _load_pages(self, first_page: int, last_page: int) -> List[PdfImage]:
+        page_numbers = range(first_page, last_page + 1)
+        images = {
+            page_number: PdfImage(
+                None, page_number, text=self._text_pages.get(page_number)
             )
+            for page_number in page_numbers
+            if page_number in self._text_pages or page_number in self._known
+        }
+
+        to_render = [
+            page_number for page_number in page_numbers if page_number not in images
         ]
+        for run_first, run_last in self._page_runs(to_render):
+            rendered = self._render(run_first, run_last, self.load_dpi)
+            for i, page_number in enumerate(range(run_first, run_last + 1)):
+                # Drops every PIL image as soon as its pixels are copied.
+                img, rendered[i] = rendered[i], None
+                images[page_number] = PdfImage(img, page_number, dpi=self.load_dpi)
+
+        return [images[page_number] for page_number in sorted(images)]
+
+    def _iter_windows(self) -> Iterator[List[PdfImage]]:
+        info = pdfinfo_from_path(self.file_path, poppler_path=poppler_path)
+        self.pages_count = int(info.get("Pages", 0))
+
+        if not self.pages_count:
+            raise ValueError("PDF seems to be empty or broken.")
+
+        if self.text_layer:
+            self._text_pages = self._read_text_layer()
+
+        if not self.streaming:
+            self._split_file()
+            yield self._images
+            return
+
+        window = self._window_size(info)
+        for first_page in range(1, self.pages_count + 1, window):
+            last_page = min(first_page + window - 1, self.pages_count)
+            self._split_file(first_page, last_page)
+            yield self._images
+
+        self._images = []
+
+    @property
+    def file_digest(self) -> str:
+        if self._digest is None:
+            self._digest = file_digest(self.file_path)
+        return self._digest
+
+    @property
+    def journal_path(self) -> str:
+        # Kept next to the final outputs, so it outlives a spool worker's
+        # staging directory.
+        return os.path.join(
+            self.final_output_dir,
+            f".{self.source_name}.{self.file_digest[:16]}.journal",
+        )
+
+    def _open_journal(self) -> None:
+        self.journal = PageJournal(
+            self.journal_path,
+            self.file_digest,
+            {
+                "dpi": cfg.RASTER_DPI,
+                "load_dpi": self.load_dpi,
+                "text_layer": self.text_layer,
+                "output_mode": self.output_mode,
+                "bilevel": self.bilevel,
+                "model": str(cfg.MODEL_PATH),
+                "backend": cfg.CLASSIFIER_BACKEND,
+            },
+        )
+
+        # A group whose write was interrupted counts as written only if the
+        # output already has all of its pages.
+        if pending := self.journal.pending:
+            file_path = self._output_path(pending["wz"])
+            if (
+                os.path.exists(file_path)
+                and pdfinfo_from_path(file_path, poppler_path=poppler_path)["Pages"]
+                == pending["total"]
+            ):
+                self.journal.written()
+            else:
+                self.journal.discard_pending()
+
+        # Groups written to a staging directory that did not survive are
+        # written again from the journaled page results.
+        for wz in list(self.journal.groups):
+            if not os.path.exists(self._output_path(wz)):
+                self.journal.forget(wz)
+
+        self._known = dict(self.journal.pages)
+        self._written = self.journal.written_pages
+        self._skipped = set(self.journal.skipped)
+        self.groups = {wz: list(pages) for wz, pages in self.journal.groups.items()}
+        if self._known:
+            metrics.increment("pages_resumed", len(self._known))
+            print(
+                f"Resuming {self.file_path}: {len(self._known)} pages analysed, "
+                f"{len(self.groups)} WZ's written."
+            )
+
+    def _journal_page(
+        self, page_number: int, cls: str, wz_nr: Optional[str], is_empty: bool
+    ) -> None:
+        if self.journal:
+            self.journal.page(page_number, cls, wz_nr, is_empty)
+
+    def _skip_copy(self) -> bool:
+        # A byte-identical copy of a processed file is skipped before it is
+        # even rasterized.
+        original = duplicates.find_file(self.file_digest)
+        if original is None:
+            return False
+
+        duplicates.link(self.source_name, None, original, "skipped")
+        metrics.increment("files_duplicate")
+        print(f"Skipping {self.file_path}, a copy of {original['file']}.")
+        return True
 
     def process_pdf(self) -> None:
-        self._split_file()
-        pattern = r"(WZK|WZ-\d+/\d+/[A-Z]+/\d+)"
+        if self.duplicate_mode == "skip" and self._skip_copy():
+            self._processed = True
+            return
+
+        if self.journaling:
+            self._open_journal()
+
+        with tracer.span("process_pdf", file=os.path.basename(self.file_path)):
+            for images in self._iter_windows():
+                if not images:
+                    raise ValueError("PDF seems to be empty or broken.")
+
+                self._process_images(images)
+
+                if self.streaming:
+                    self._flush()
+
+        self._report_duplicates()
+        self._processed = True
+
+    def _link_duplicate(self, image: PdfImage) -> None:
+        with tracer.span("link_duplicate", page=image.page_number):
+            hashes = page_hashes(image._page, HEADER_BAND)
+            self._hashes[image.page_number] = hashes
+            original = duplicates.find(*hashes)
+        if original is None:
+            return
+
+        self._linked[image.page_number] = original
+        duplicates.link(self.source_name, image.page_number, original, "linked")
+        metrics.increment("pages_duplicate")
+        # Pages of one form can differ in little more than their WZ number,
+        # so a linked WZ page only skips the classifier and its number is
+        # always read from the page itself.
+        if original["class"] != "WZ":
+            cls, is_empty = original["class"], original["empty"]
+            self._known[image.page_number] = (cls, None, is_empty)
+            self._journal_page(image.page_number, cls, None, is_empty)
+
+    def _report_duplicates(self) -> None:
+        if not self._linked:
+            return
+
+        originals = {original["file"] for original in self._linked.values()}
+        print(
+            f"{self.source_name}: {len(self._linked)} pages seen before in {originals}."
+        )
+        if len(originals) == 1 and set(self._linked) == set(self._hashes):
+            duplicates.link(
+                self.source_name, None, {"file": originals.pop()}, "document"
+            )
+
+    def _find_wz_number(self, image: PdfImage) -> Optional[str]:
+        return cache.memoize(
+            "wz_number",
+            {
+                "pattern": WZ_PATTERN,
+                "fuzzy": cfg.WZ_FUZZY_MATCH and cfg.WZ_MATCH_MIN_CONFIDENCE,
+                "easyocr": "batch" if cfg.EASYOCR_BATCH else "page",
+            },
+            image.get_page_digest,
+            lambda: self._read_wz_number(image),
+        )
+
+    def _render_full_header(self, image: PdfImage) -> None:
+        # In two-pass mode every OCR of a header, also the EasyOCR fallback
+        # after a cached miss, reads the header band rendered at RASTER_DPI.
+        if self.two_pass and not image.is_cut:
+            image.set_header(self._render_header(image))
+
+    def _read_wz_number(self, image: PdfImage) -> Optional[str]:
+        self._render_full_header(image)
+
+        layout, kind = None, "default"
+        if layouts.enabled:
+            layout = fingerprint(image._page, HEADER_BAND)
+            match = layouts.find(layout)
+            if match is not None:
+                kind = format(match[0], "x")
+            if wz_nr := self._read_layout_region(image, match):
+                return wz_nr
+
+        header = image.header()
+        wz_nr, step = strategies.run(
+            kind, self._wz_steps(image, header, easyocr=not cfg.EASYOCR_BATCH)
+        )
+        # Without a match the page goes to the batched EasyOCR fallback.
+        if step or not cfg.EASYOCR_BATCH:
+            metrics.increment("wz_found", step=step or "none")
+
+        if wz_nr and layout is not None:
+            self._learn_region(
+                layout, image if step.startswith("page") else header, wz_nr
+            )
+        return wz_nr
+
+    @staticmethod
+    def _learn_region(layout: np.ndarray, view: PdfImage, wz_nr: str) -> None:
+        with tracer.span("locate_wz_number", page=view.page_number):
+            if box := view.locate(wz_nr):
+                layouts.learn(layout, box)
 
-        def find_number(content: str) -> Optional[str]:
-            if wz_match := re.search(pattern, content):
-                return wz_match.group(1)
+    def _read_layout_region(
+        self, image: PdfImage, match: Optional[tuple]
+    ) -> Optional[str]:
+        if match is None:
+            metrics.increment("layout_region", result="unknown")
             return None
 
-        if not self._images:
-            raise ValueError("PDF seems to be empty or broken.")
+        known, box = match
+        content = image.get_region_content(box)
+        wz_nr = find_number(content) if content else None
+        layouts.record(known, hit=bool(wz_nr))
+        metrics.increment("layout_region", result="hit" if wz_nr else "miss")
+        if wz_nr:
+            metrics.increment("wz_found", step="layout_region")
+        return wz_nr
 
-        wz_number: Optional[str] = None
+    @staticmethod
+    def _wz_steps(image: PdfImage, header: PdfImage, easyocr: bool = True) -> dict:
+        def read_easyocr() -> Optional[str]:
+            metrics.increment("easyocr_calls")
+            return find_number(header.get_easyocr_content())
 
-        for i, image in enumerate(self._images):
-            res = recognizer.recognize(image.obj)
-            cls = res["class"]
-            if cls == "WZ":
-                wz_nr = find_number(image.get_content())
-
-                if not wz_nr:
-                    image.cut()
-                    wz_nr = (
-                        find_number(image.get_content())
-                        or find_number(image.get_content(11, 3))
-                        or find_number(image.get_content(6, 1))
-                        or find_number(image.get_content(3, 3))
-                    )
+        steps = {}
+        if not image.is_cut:
+            steps["page_psm6_oem3"] = lambda: find_number(image.get_content())
+        for psm, oem in ((6, 3), (11, 3), (6, 1), (3, 3)):
+            steps[f"header_psm{psm}_oem{oem}"] = lambda psm=psm, oem=oem: find_number(
+                header.get_content(psm, oem)
+            )
+        if easyocr:
+            steps["easyocr"] = read_easyocr
+        return steps
+
+    def _read_fallback(
+        self, images: List[PdfImage], results: List[dict], analysed: list
+    ) -> list:
+        missing = [
+            i
+            for i, (res, (_, wz_nr)) in enumerate(zip(results, analysed))
+            if res["class"] == "WZ" and not wz_nr
+        ]
+        if not missing:
+            return analysed
+
+        for i in missing:
+            self._render_full_header(images[i])
+        headers = [images[i].header() for i in missing]
+        with tracer.span(
+            "easyocr_fallback", pages=[image.page_number for image in headers]
+        ):
+            metrics.increment("easyocr_calls", len(headers))
+            numbers = fallback.run(
+                [header._image for header in headers],
+                find_number,
+                digests=[header.get_digest() for header in headers]
+                if cache.enabled
+                else None,
+            )
+
+        for i, header, wz_nr in zip(missing, headers, numbers):
+            step = "easyocr_regions" if wz_nr else None
+            if not wz_nr and cfg.EASYOCR_FULL_FALLBACK:
+                wz_nr = find_number(header.get_easyocr_content())
+                step = "easyocr" if wz_nr else None
+            metrics.increment("wz_found", step=step or "none")
+
+            if wz_nr and layouts.enabled:
+                layout = fingerprint(images[i]._page, HEADER_BAND)
+                self._learn_region(layout, header, wz_nr)
+            self._journal_page(images[i].page_number, "WZ", wz_nr, False)
+            analysed[i] = (False, wz_nr)
+        return analysed
+
+    def _analyse_page(self, image: PdfImage, res: dict) -> tuple[bool, Optional[str]]:
+        with tracer.span("analyse_page", page=image.page_number, cls=res["class"]):
+            if res["class"] == "WZ":
+                wz_nr = self._find_wz_number(image)
+                # Pages left to the EasyOCR fallback are journaled after it.
+                if wz_nr or not cfg.EASYOCR_BATCH:
+                    self._journal_page(image.page_number, "WZ", wz_nr, False)
+                return False, wz_nr
 
-                if not wz_nr:
-                    content = reader.readtext(
-                        image._image,
-                        decoder="beamsearch",
-                        text_threshold=0.8,
-                        low_text=0.3,
-                        contrast_ths=0.2,
-                        adjust_contrast=0.7,
-                        canvas_size=4096,
+            if self.two_pass:
+                is_empty = image.is_page_empty(
+                    lambda: self._render_page(image.page_number)
+                )
+            else:
+                is_empty = image.is_page_empty()
+            self._journal_page(image.page_number, res["class"], None, is_empty)
+            return is_empty, None
+
+    def _process_images(self, images: List[PdfImage]) -> None:
+        rendered = [image for image in images if image.rendered]
+        if self.duplicate_mode != "off" and rendered:
+            with ThreadPoolExecutor(max_workers=self.ocr_workers) as executor:
+                list(executor.map(self._link_duplicate, rendered))
+            rendered = [
+                image for image in rendered if image.page_number not in self._known
+            ]
+
+        # Windows of text layer, resumed or duplicate pages do not need the
+        # classifier.
+        to_classify = [
+            image for image in rendered if image.page_number not in self._linked
+        ]
+        classified = iter([])
+        if to_classify:
+            with (
+                metrics.stage("classify"),
+                tracer.span(
+                    "recognize",
+                    pages=[image.page_number for image in to_classify],
+                ),
+            ):
+                classified = iter(
+                    models.recognizer.recognize_batch(
+                        [image._image for image in to_classify],
+                        digests=[image.get_page_digest() for image in to_classify]
+                        if cache.enabled
+                        else None,
                     )
-                    text = " ".join([phrase for _, phrase, _ in content])
-                    wz_nr = find_number(text)
+                )
+            metrics.increment("pages_classified", len(to_classify))
+        results = [
+            {"class": "WZ"} if image.page_number in self._linked else next(classified)
+            for image in rendered
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.ocr_workers) as executor:
+            analysed = list(executor.map(self._analyse_page, rendered, results))
+        if cfg.EASYOCR_BATCH:
+            analysed = self._read_fallback(rendered, results, analysed)
+
+        outcomes = iter(zip(results, analysed))
+        indexed = []
+        for image in images:
+            if image.page_number in self._known:
+                cls, wz_nr, is_empty = self._known[image.page_number]
+            elif image.rendered:
+                res, (is_empty, wz_nr) = next(outcomes)
+                cls = res["class"]
+                if image.page_number in self._linked:
+                    self._linked_numbers[image.page_number] = wz_nr
+                hashes = self._hashes.get(image.page_number)
+                if hashes and image.page_number not in self._linked:
+                    indexed.append((
+                        *hashes,
+                        self.source_name,
+                        image.page_number,
+                        cls,
+                        wz_nr,
+                        is_empty,
+                    ))
+            else:
+                wz_nr = find_number(image.text)
+                cls, is_empty = "WZ" if wz_nr else "NO_WZ", False
 
+            if cls == "WZ":
                 if wz_nr:
-                    wz_number = wz_nr
+                    self._wz_number = wz_nr
 
-            elif image.is_page_empty():
+            elif is_empty:
+                metrics.increment("pages_empty")
                 continue
 
-            if wz_number:
+            if self._wz_number:
+                if image.page_number in self._written:
+                    continue
+
+                # Low-DPI pages are rendered again at full DPI when saved.
+                if self.output_mode == "copy" or self.two_pass:
+                    image.release()
+                elif self.spill:
+                    image.spill(self.spill_dir)
+
                 try:
-                    self._wz_aggregation[wz_number].append(image)
+                    self._wz_aggregation[self._wz_number].append(image)
                 except KeyError:
-                    self._wz_aggregation[wz_number] = [image]
+                    self._wz_aggregation[self._wz_number] = [image]
 
-        self._processed = True
+        duplicates.add(indexed)
 
     def parse_filename(self, name: str) -> str:
         return name.replace("/", "_")
 
-    def save_all(self) -> None:
+    def _output_path(self, wz_number: str) -> str:
+        return f"{self.output_dir}/{self.parse_filename(wz_number)}.pdf"
+
+    def _flush(self) -> None:
+        for wz_number, images in self._wz_aggregation.items():
+            file_path = self._output_path(wz_number)
+            page_numbers = [image.page_number for image in images]
+            if self._skip_group(wz_number, file_path, page_numbers):
+                if wz_number not in self._skipped:
+                    print(f"Skipped {wz_number}, all its pages were saved before.")
+                    metrics.increment("wz_duplicate")
+                    self._skipped.add(wz_number)
+                if self.journal:
+                    self.journal.skip(wz_number, page_numbers)
+                for image in images:
+                    image.release()
+                continue
+
+            # Pages after a skipped part of a WZ go to its existing file, which
+            # a spool worker first takes into its staging directory.
+            append = wz_number in self.groups or wz_number in self._skipped
+            if append and not os.path.exists(file_path):
+                copyfile(
+                    os.path.join(self.final_output_dir, os.path.basename(file_path)),
+                    file_path,
+                )
+            if self.journal:
+                # Counted from the file, which also holds the pages of a part
+                # skipped as a duplicate.
+                existing = (
+                    pdfinfo_from_path(file_path, poppler_path=poppler_path)["Pages"]
+                    if append
+                    else 0
+                )
+                self.journal.write(
+                    wz_number, page_numbers, existing + len(page_numbers)
+                )
+            with (
+                metrics.stage("save"),
+                tracer.span("save_pdf", wz=wz_number, pages=len(images)),
+            ):
+                self.save_pdf(file_path, images, append=append)
+            if self.journal:
+                self.journal.written()
+
+            self.groups.setdefault(wz_number, []).extend(page_numbers)
+            for image in images:
+                image.release()
+
+        self._wz_aggregation = {}
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
+
+    def _skip_group(self, wz_number: str, file_path: str, page_numbers: list) -> bool:
+        # Keeps an existing WZ file instead of overwriting it with an exact
+        # re-scan: every page matched a stored page exactly, and WZ pages one
+        # with the number read from them, also when none could be read.
+        originals = [self._linked.get(page) for page in page_numbers]
+        return (
+            self.duplicate_mode == "skip"
+            and wz_number not in self.groups
+            and all(
+                original is not None and original["distance"] == 0
+                for original in originals
+            )
+            and all(
+                original["wz"] == self._linked_numbers.get(page)
+                for page, original in zip(page_numbers, originals)
+                if original["class"] == "WZ"
+            )
+            and (
+                wz_number in self._skipped
+                or os.path.exists(
+                    os.path.join(self.final_output_dir, os.path.basename(file_path))
+                )
+            )
+        )
+
+    def save_all(self, move: bool = True) -> None:
         if not self._processed:
             raise ValueError("PDF not processed yet.")
 
-        counter = 0
-
-        for wz_number, images in self._wz_aggregation.items():
-            file_path = f"{self.output_dir}/{self.parse_filename(wz_number)}.pdf"
-            self.save_pdf(file_path, images)
-            counter += 1
+        self._flush()
+        if self.journal:
+            self.journal.remove()
+            self.journal = None
+        if self.duplicate_mode != "off":
+            duplicates.add_file(self.file_digest, self.source_name, self.pages_count)
 
-        print(f"Created {counter} new WZ's out of {self.file_path}.")
-        self.move_done()
+        print(f"Created {self.wz_count} new WZ's out of {self.file_path}.")
+        if move:
+            self.move_done()
 
     def move_done(self) -> None:
         if not self._processed:
@@ -175,16 +1112,81 @@ class PdfFileProcessor:
 
         file_name = os.path.basename(self.file_path)
         new_file_path = os.path.join(self.done_dir_path, file_name)
-        move(
-            self.file_path,
-            new_file_path,
-        )
+        with metrics.stage("move"), tracer.span("move_done", file=file_name):
+            move(
+                self.file_path,
+                new_file_path,
+            )
         print(f"Moved {file_name} to {new_file_path}.")
 
-    def save_pdf(self, file_path: str, images: List[Image]) -> None:
-        images[0].save(
-            file_path,
-            save_all=True,
-            append_images=images[1:],
-            force_update=True,
+    def _render_missing(self, images: List[PdfImage]) -> None:
+        missing = {image.page_number: image for image in images if not image.rendered}
+
+        for run_first, run_last in self._page_runs(sorted(missing)):
+            for page_number, img in enumerate(
+                self._render(run_first, run_last), start=run_first
+            ):
+                missing[page_number].raw = img
+
+    def _copy_pages(
+        self, file_path: str, page_numbers: List[int], append: bool = False
+    ) -> None:
+        with tempfile.TemporaryDirectory(dir=self.output_dir) as tmp_dir:
+            page_pattern = os.path.join(tmp_dir, "page-%d.pdf")
+            for run_first, run_last in self._page_runs(page_numbers):
+                subprocess.run(
+                    [
+                        poppler_command("pdfseparate"),
+                        "-f",
+                        str(run_first),
+                        "-l",
+                        str(run_last),
+                        self.file_path,
+                        page_pattern,
+                    ],
+                    capture_output=True,
+                    check=True,
+                )
+
+            sources = [file_path] if append else []
+            sources += [page_pattern % page_number for page_number in page_numbers]
+            tmp_path = os.path.join(tmp_dir, "output.pdf")
+            subprocess.run(
+                [poppler_command("pdfunite"), *sources, tmp_path],
+                capture_output=True,
+                check=True,
+            )
+            os.replace(tmp_path, file_path)
+
+    def save_pdf(
+        self, file_path: str, images: List[PdfImage], append: bool = False
+    ) -> None:
+        if self.output_mode == "copy":
+            page_numbers = [image.page_number for image in images]
+            self._copy_pages(file_path, page_numbers, append=append)
+            return
+
+        # Written next to the output and renamed over it, so an interrupted
+        # save never leaves a partly appended file behind.
+        tmp_path = os.path.join(
+            os.path.dirname(file_path), f".{os.path.basename(file_path)}.tmp"
         )
+        if append:
+            copyfile(file_path, tmp_path)
+        # Pages are rendered and converted a chunk at a time, so spilled pages
+        # are not all read back into memory together.
+        for start in range(0, len(images), SAVE_CHUNK):
+            chunk = images[start : start + SAVE_CHUNK]
+            self._render_missing(chunk)
+            chunk[0].save(
+                tmp_path,
+                format="PDF",
+                save_all=True,
+                append_images=chunk[1:],
+                append=append or start > 0,
+                force_update=True,
+                bilevel=self.bilevel,
+            )
+            for image in chunk:
+                image.release()
+        os.replace(tmp_path, file_path)
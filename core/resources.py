@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from core import cfg
+from core.stores import isolated_settings
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def available_cpus() -> list[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+# Splits one CPU budget between the file worker processes, the page threads of
+# every file and the thread pools of the engines running inside them, which
+# otherwise each size themselves for the whole machine. Explicit settings win
+# over a tuned profile, which wins over the defaults derived from the budget.
+class ResourceGovernor:
+    def __init__(self, budget: int = None, profile_path: str = None) -> None:
+        self.budget = budget or cfg.CPU_BUDGET or len(available_cpus())
+        self.profile_path = profile_path or cfg.THREAD_PROFILE_PATH
+        self._profile: Optional[dict] = None
+        self.plan = self.split()
+
+    @property
+    def profile(self) -> dict:
+        if self._profile is None:
+            self._profile = {}
+            if os.path.exists(self.profile_path):
+                with open(self.profile_path) as f:
+                    profile = json.load(f)
+                # A profile tuned for another budget does not apply.
+                if profile.get("budget") == self.budget:
+                    self._profile = profile["plan"]
+        return self._profile
+
+    def split(self, workers: int = None, shared: bool = False) -> dict:
+        workers = workers or cfg.FILE_WORKERS or self.profile.get("file_workers", 1)
+        share = max(1, self.budget // workers)
+        page_threads = cfg.OCR_WORKERS or self.profile.get("page_threads", share)
+        # Workers running as threads of one process share the model pools.
+        pool = self.budget if shared else share
+        return {
+            "budget": self.budget,
+            "file_workers": workers,
+            "page_threads": page_threads,
+            "tesseract": cfg.TESSERACT_THREADS
+            or self.profile.get("tesseract", max(1, share // page_threads)),
+            "classifier": cfg.CLASSIFIER_THREADS or pool,
+            "torch": cfg.TORCH_THREADS or pool,
+            "raster": cfg.RASTER_THREADS or min(4, share),
+        }
+
+    def configure(self, workers: int = None, shared: bool = False) -> dict:
+        self.plan = self.split(workers, shared)
+        return self.plan
+
+    @property
+    def file_workers(self) -> int:
+        return self.plan["file_workers"]
+
+    @property
+    def page_threads(self) -> int:
+        return self.plan["page_threads"]
+
+    @property
+    def raster_threads(self) -> int:
+        return self.plan["raster"]
+
+    def tesseract_env(self) -> dict:
+        # Only passed to Tesseract processes: OMP_THREAD_LIMIT in our own
+        # environment would also cap PyTorch's OpenMP pool.
+        return {**os.environ, "OMP_THREAD_LIMIT": str(self.plan["tesseract"])}
+
+    def configure_torch(self) -> None:
+        import torch
+
+        torch.set_num_threads(self.plan["torch"])
+
+    def pin(self, slot: int = None) -> None:
+        # Keeps the process on the budgeted CPUs; a file worker process gets
+        # its own share of them.
+        if not cfg.CPU_AFFINITY or not hasattr(os, "sched_setaffinity"):
+            return
+        cpus = available_cpus()[: self.budget]
+        if slot is not None:
+            share = max(1, len(cpus) // self.plan["file_workers"])
+            start = (slot % self.plan["file_workers"]) * share
+            cpus = cpus[start : start + share] or cpus
+        os.sched_setaffinity(0, cpus)
+
+    def candidates(self, files: int) -> list[dict]:
+        splits = []
+        workers = 1
+        while workers <= min(self.budget, files):
+            share = self.budget // workers
+            for page_threads in sorted({share, max(1, share // 2), max(1, share // 4)}):
+                splits.append({
+                    "file_workers": workers,
+                    "page_threads": page_threads,
+                    "tesseract": max(1, share // page_threads),
+                })
+            workers *= 2
+        return splits
+
+    def save_profile(self, plan: dict, results: list[dict]) -> None:
+        os.makedirs(os.path.dirname(self.profile_path), exist_ok=True)
+        with open(self.profile_path, "w") as f:
+            json.dump(
+                {"budget": self.budget, "plan": plan, "results": results}, f, indent=2
+            )
+        self._profile = plan
+
+
+def count_pages(file_path: str) -> int:
+    from pdf2image import pdfinfo_from_path
+
+    return pdfinfo_from_path(file_path, poppler_path=cfg.POPPLER_PATH)["Pages"]
+
+
+def measure(split: dict, files: list[str], budget: int) -> float:
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Every candidate starts cold, without what earlier candidates stored.
+        env = {
+            **os.environ,
+            **isolated_settings(os.path.join(work_dir, "stores")),
+            "CPU_BUDGET": str(budget),
+            "OCR_WORKERS": str(split["page_threads"]),
+            "TESSERACT_THREADS": str(split["tesseract"]),
+        }
+        input_dir = os.path.join(work_dir, "input")
+        os.makedirs(input_dir)
+        for file_path in files:
+            shutil.copy(file_path, input_dir)
+
+        started = time.perf_counter()
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.join(REPO_DIR, "main.py"),
+                "--path",
+                input_dir,
+                "--output",
+                os.path.join(work_dir, "output"),
+                "--workers",
+                str(split["file_workers"]),
+                "--no-cache",
+            ],
+            cwd=REPO_DIR,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        return time.perf_counter() - started
+
+
+def tune(args: argparse.Namespace) -> None:
+    tuner = ResourceGovernor(args.budget, args.profile)
+    files = sorted(
+        os.path.join(args.path, name)
+        for name in os.listdir(args.path)
+        if name.lower().endswith(".pdf")
+    )[: args.limit]
+    if not files:
+        raise ValueError(f"No PDF files found in {args.path}.")
+    pages = sum(count_pages(file_path) for file_path in files)
+
+    results = []
+    for split in tuner.candidates(len(files)):
+        seconds = measure(split, files, tuner.budget)
+        results.append({**split, "pages_per_second": pages / seconds})
+        print(
+            f"workers={split['file_workers']} page_threads={split['page_threads']} "
+            f"tesseract={split['tesseract']}: {pages / seconds:.2f} pages/s"
+        )
+
+    best = max(results, key=lambda result: result["pages_per_second"])
+    plan = {key: best[key] for key in ("file_workers", "page_threads", "tesseract")}
+    tuner.save_profile(plan, results)
+    print(f"Saved {plan} for a budget of {tuner.budget} CPUs to {tuner.profile_path}.")
+
+
+def show(args: argparse.Namespace) -> None:
+    governor = ResourceGovernor(args.budget, args.profile)
+    print(json.dumps(governor.split(args.workers), indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Show or tune the split of the CPU budget between thread pools."
+    )
+    parser.add_argument("--budget", type=int, help="Number of CPUs to use.")
+    parser.add_argument(
+        "--profile",
+        type=str,
+        # cfg.THREAD_PROFILE_PATH is relative to this module when run with -m.
+        default=os.path.join(REPO_DIR, ".cache", "threads.json"),
+        help="Tuned profile file, by default the one main.py reads.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    show_parser = commands.add_parser("show", help="Print the current thread split.")
+    show_parser.add_argument("--workers", type=int)
+    show_parser.set_defaults(handler=show)
+
+    tune_parser = commands.add_parser(
+        "tune", help="Benchmark candidate splits on sample PDFs and save the best."
+    )
+    tune_parser.add_argument("path", type=str, help="Directory with sample PDFs.")
+    tune_parser.add_argument(
+        "--limit", type=int, default=8, help="Number of PDF files to process."
+    )
+    tune_parser.set_defaults(handler=tune)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+governor = ResourceGovernor()
+
+
+if __name__ == "__main__":
+    main()
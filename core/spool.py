@@ -0,0 +1,282 @@
+import errno
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+from datetime import datetime
+from threading import Event, Thread
+from typing import Optional
+
+from core import cfg
+from core.metrics import metrics
+from core.reader import PdfFileProcessor
+from core.tracing import tracer
+
+LEASE_SEPARATOR = "@"
+
+
+def publish(source: str, target: str) -> None:
+    # Atomic on one filesystem; across filesystems the copy is made under a
+    # temporary name and renamed into place, so readers never see half a file.
+    try:
+        os.replace(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp_path = os.path.join(
+            os.path.dirname(target), f".{os.path.basename(target)}.{uuid.uuid4().hex}"
+        )
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, target)
+        os.remove(source)
+
+
+# A file is claimed by renaming it into .spool/leases under a name carrying the
+# worker id, and the lease is kept alive by touching that file. Results are
+# written to a staging directory and committed by renaming it into
+# .spool/committing, from where any worker can finish publishing a commit whose
+# owner died. Expired leases are put back into the input directory.
+class SpoolWorker:
+    def __init__(
+        self,
+        path: str,
+        output: str,
+        options: dict = None,
+        lease_seconds: float = None,
+        poll_interval: float = None,
+    ) -> None:
+        self.path = path
+        self.output = output
+        self.options = options or {}
+        self.lease_seconds = lease_seconds or cfg.SPOOL_LEASE_SECONDS
+        self.poll_interval = poll_interval or cfg.SPOOL_POLL_INTERVAL
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        spool = os.path.join(path, cfg.SPOOL_DIR_NAME)
+        self.leases_dir = os.path.join(spool, "leases")
+        self.staging_dir = os.path.join(spool, "staging")
+        self.committing_dir = os.path.join(spool, "committing")
+        self.failed_dir = os.path.join(spool, "failed")
+        for dir_path in (
+            self.leases_dir,
+            self.staging_dir,
+            self.committing_dir,
+            self.failed_dir,
+        ):
+            os.makedirs(dir_path, exist_ok=True)
+
+    def _expired(self, path: str, now: float) -> bool:
+        # A rename keeps the mtime of the file but updates its ctime, so a
+        # lease is fresh from the moment it is claimed, before it is touched.
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return now - max(stat.st_mtime, stat.st_ctime) > self.lease_seconds
+
+    @staticmethod
+    def source_name(lease_name: str) -> str:
+        return lease_name.rsplit(LEASE_SEPARATOR, 1)[0]
+
+    def claim(self) -> Optional[str]:
+        now = time.time()
+        for entry in sorted(os.scandir(self.path), key=lambda entry: entry.name):
+            if not entry.is_file() or not entry.name.lower().endswith(".pdf"):
+                continue
+            # Files still being copied in are left alone.
+            try:
+                if now - entry.stat().st_mtime < cfg.WATCHER_STABLE_SECONDS:
+                    continue
+            except OSError:
+                continue  # Claimed by another worker meanwhile.
+
+            lease_path = os.path.join(
+                self.leases_dir, f"{entry.name}{LEASE_SEPARATOR}{self.worker_id}"
+            )
+            try:
+                os.rename(entry.path, lease_path)
+            except OSError:
+                continue  # Claimed by another worker first.
+
+            try:
+                os.utime(lease_path)
+            except OSError:
+                continue  # Requeued by another worker meanwhile.
+            metrics.increment("spool_claimed")
+            return lease_path
+        return None
+
+    def _heartbeat(self, lease_path: str, done: Event) -> None:
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                os.utime(lease_path)
+            except OSError:
+                logging.warning(f"Lost lease {os.path.basename(lease_path)}")
+                return
+
+    def recover(self) -> None:
+        now = time.time()
+
+        for entry in os.scandir(self.leases_dir):
+            if self._expired(entry.path, now):
+                self._requeue(entry.path, entry.name)
+
+        for entry in os.scandir(self.staging_dir):
+            lease_path = os.path.join(self.leases_dir, entry.name)
+            if os.path.exists(lease_path) or not self._expired(entry.path, now):
+                continue
+            source = os.path.join(entry.path, "source.pdf")
+            if os.path.exists(source):
+                self._requeue(source, entry.name)
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+        for entry in os.scandir(self.committing_dir):
+            if self._expired(entry.path, now):
+                logging.info(f"Finishing abandoned commit {entry.name}")
+                if self._finish_commit(entry.path):
+                    metrics.increment("spool_recovered")
+
+    def _requeue(self, path: str, lease_name: str) -> None:
+        try:
+            os.rename(path, os.path.join(self.path, self.source_name(lease_name)))
+        except OSError:
+            return  # Requeued or committed by another worker meanwhile.
+        logging.info(f"Requeued {self.source_name(lease_name)} from an expired lease")
+        metrics.increment("spool_requeued")
+
+    def _park(self, lease_path: str, staging: str) -> None:
+        # Failed files are parked instead of requeued, so a broken file is not
+        # retried by every worker in turn.
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            os.rename(
+                lease_path,
+                os.path.join(
+                    self.failed_dir, self.source_name(os.path.basename(lease_path))
+                ),
+            )
+        except OSError:
+            pass
+
+    def run_processor(self, source: str, staging: str) -> PdfFileProcessor:
+        processor = PdfFileProcessor(
+            source,
+            output_dir=staging,
+            final_output_dir=self.output,
+            source_name=self.source_name(os.path.basename(source)),
+            **self.options,
+        )
+        processor.process_pdf()
+        processor.save_all(move=False)
+        return processor
+
+    def process(self, lease_path: str) -> Optional[PdfFileProcessor]:
+        lease_name = os.path.basename(lease_path)
+        staging = os.path.join(self.staging_dir, lease_name)
+        os.makedirs(staging, exist_ok=True)
+
+        done = Event()
+        heartbeat = Thread(target=self._heartbeat, args=(lease_path, done), daemon=True)
+        heartbeat.start()
+        try:
+            with metrics.stage("file"), tracer.span("file", file=lease_name):
+                processor = self.run_processor(lease_path, staging)
+        except Exception as e:
+            logging.error(f"Error: {self.source_name(lease_name)}: {e}")
+            processor = None
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if processor is None:
+            metrics.increment("files_failed")
+            self._park(lease_path, staging)
+            return None
+
+        if not self.commit(lease_path, staging):
+            return None
+        metrics.increment("files_processed")
+        metrics.increment("wz_created", processor.wz_count)
+        return processor
+
+    def commit(self, lease_path: str, staging: str) -> bool:
+        lease_name = os.path.basename(lease_path)
+        outputs = sorted(
+            name
+            for name in os.listdir(staging)
+            if os.path.isfile(os.path.join(staging, name))
+        )
+        done_dir = os.path.join(self.output, datetime.now().strftime("%d-%m-%Y"))
+        manifest = {
+            "outputs": outputs,
+            "output_dir": self.output,
+            "done": os.path.join(done_dir, self.source_name(lease_name)),
+        }
+        tmp_path = os.path.join(staging, ".manifest.json")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(staging, "manifest.json"))
+
+        # Taking the source out of the leases directory fails when the lease
+        # expired and the file was handed to another worker.
+        try:
+            os.rename(lease_path, os.path.join(staging, "source.pdf"))
+        except OSError:
+            logging.warning(f"Lease {lease_name} expired, discarding results")
+            metrics.increment("spool_lost_leases")
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+
+        committing = os.path.join(self.committing_dir, lease_name)
+        os.rename(staging, committing)
+        self._finish_commit(committing)
+        metrics.increment("spool_committed")
+        return True
+
+    def _finish_commit(self, committing: str) -> bool:
+        # Idempotent, so a commit interrupted at any point can be replayed, and
+        # two workers may replay one commit at once: whatever is missing was
+        # already published by the other.
+        try:
+            with open(os.path.join(committing, "manifest.json")) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return False
+
+        os.makedirs(manifest["output_dir"], exist_ok=True)
+        for name in manifest["outputs"]:
+            try:
+                publish(
+                    os.path.join(committing, name),
+                    os.path.join(manifest["output_dir"], name),
+                )
+            except FileNotFoundError:
+                pass
+
+        os.makedirs(os.path.dirname(manifest["done"]), exist_ok=True)
+        try:
+            publish(os.path.join(committing, "source.pdf"), manifest["done"])
+        except FileNotFoundError:
+            pass
+        else:
+            print(f"Moved {os.path.basename(manifest['done'])} to {manifest['done']}.")
+
+        shutil.rmtree(committing, ignore_errors=True)
+        return True
+
+    def run(self, watch: bool = False) -> int:
+        processed = 0
+        logging.info(f"Spool worker {self.worker_id} started on {self.path}")
+
+        while True:
+            self.recover()
+            if lease_path := self.claim():
+                processed += self.process(lease_path) is not None
+                continue
+
+            if not watch and not os.listdir(self.leases_dir):
+                return processed
+            time.sleep(self.poll_interval)
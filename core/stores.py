@@ -0,0 +1,27 @@
+import os
+
+from core import cfg
+from core.cache import cache
+from core.duplicates import duplicates
+from core.layouts import layouts
+
+
+# Benchmark and calibration runs keep their stores in a directory of their own,
+# so they start cold and do not fill the stores of production runs.
+def isolated_settings(directory: str) -> dict[str, str]:
+    return {
+        "CACHE_PATH": os.path.join(directory, "cache.sqlite3"),
+        "LAYOUT_STORE_PATH": os.path.join(directory, "layouts.sqlite3"),
+        "DUPLICATES_INDEX_PATH": os.path.join(directory, "duplicates.sqlite3"),
+        "DUPLICATES": "off",
+        "JOURNAL": "false",
+    }
+
+
+def isolate(directory: str) -> None:
+    settings = isolated_settings(directory)
+    cache.relocate(settings["CACHE_PATH"])
+    layouts.relocate(settings["LAYOUT_STORE_PATH"])
+    duplicates.relocate(settings["DUPLICATES_INDEX_PATH"])
+    cfg.DUPLICATES = "off"
+    cfg.JOURNAL = False
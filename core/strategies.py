@@ -0,0 +1,113 @@
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Callable, Optional
+
+from core import cfg
+from core.metrics import metrics
+
+DEFAULT_ORDER = (
+    "page_psm6_oem3",
+    "header_psm6_oem3",
+    "header_psm11_oem3",
+    "header_psm6_oem1",
+    "header_psm3_oem3",
+    "easyocr",
+)
+
+
+class StrategyEngine:
+    def __init__(
+        self, order: str = "adaptive", parallel: int = 1, deterministic: bool = False
+    ) -> None:
+        self.order = order
+        self.parallel = parallel
+        self.deterministic = deterministic
+        self._lock = Lock()
+        # kind -> step -> [attempts, successes]
+        self.stats: dict[str, dict[str, list[int]]] = defaultdict(
+            lambda: defaultdict(lambda: [0, 0])
+        )
+        self.seconds: dict[str, list[float]] = defaultdict(lambda: [0, 0.0])
+
+    def _cost(self, step: str) -> float:
+        count, seconds = self.seconds[step]
+        if count:
+            return seconds / count
+        known = [total / n for n, total in self.seconds.values() if n]
+        return sum(known) / len(known) if known else 1.0
+
+    def ordered(self, kind: str, steps: list[str] = DEFAULT_ORDER) -> list[str]:
+        if self.order == "fixed" or self.deterministic:
+            return list(steps)
+
+        # Expected matches per second of OCR, with a uniform prior so untried
+        # steps keep their default position until there is evidence.
+        with self._lock:
+            stats = {step: list(self.stats[kind][step]) for step in steps}
+            costs = {step: self._cost(step) for step in steps}
+        return sorted(
+            steps,
+            key=lambda step: -(stats[step][1] + 1) / (stats[step][0] + 2) / costs[step],
+        )
+
+    def _attempt(
+        self, kind: str, step: str, read: Callable[[], Optional[str]]
+    ) -> Optional[str]:
+        started = time.perf_counter()
+        wz_nr = read()
+        seconds = time.perf_counter() - started
+
+        with self._lock:
+            self.stats[kind][step][0] += 1
+            self.stats[kind][step][1] += bool(wz_nr)
+            self.seconds[step][0] += 1
+            self.seconds[step][1] += seconds
+        metrics.increment(
+            "ocr_attempts", step=step, result="match" if wz_nr else "miss"
+        )
+        return wz_nr
+
+    def run(
+        self, kind: str, steps: dict[str, Callable[[], Optional[str]]]
+    ) -> tuple[Optional[str], Optional[str]]:
+        order = self.ordered(kind, [step for step in DEFAULT_ORDER if step in steps])
+
+        if self.parallel <= 1:
+            for step in order:
+                if wz_nr := self._attempt(kind, step, steps[step]):
+                    return wz_nr, step
+            return None, None
+
+        # The top steps run concurrently; steps that have not started yet are
+        # cancelled once one of them matches.
+        executor = ThreadPoolExecutor(max_workers=self.parallel)
+        futures = {
+            executor.submit(self._attempt, kind, step, steps[step]): step
+            for step in order
+        }
+        try:
+            if self.deterministic:
+                # Highest priority match wins, regardless of which finished first.
+                for future, step in futures.items():
+                    if wz_nr := future.result():
+                        return wz_nr, step
+                return None, None
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(
+                    done, key=lambda future: order.index(futures[future])
+                ):
+                    if wz_nr := future.result():
+                        return wz_nr, futures[future]
+            return None, None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+strategies = StrategyEngine(
+    cfg.OCR_STRATEGY_ORDER, cfg.OCR_STRATEGY_PARALLEL, cfg.OCR_STRATEGY_DETERMINISTIC
+)
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.events: list[dict] = []
+        self._threads: dict[tuple[int, int], str] = {}
+
+    @contextmanager
+    def span(self, name: str, **args) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        # Wall-clock start times keep spans from different processes aligned.
+        started = time.time_ns() // 1000
+        counter = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter_ns() - counter) // 1000
+            self.record(name, started, duration, args)
+
+    def record(self, name: str, started: int, duration: int, args: dict) -> None:
+        pid, tid = os.getpid(), threading.get_native_id()
+        event = {
+            "name": name,
+            "cat": "wz_conv",
+            "ph": "X",
+            "ts": started,
+            "dur": duration,
+            "pid": pid,
+            "tid": tid,
+            "args": {key: value for key, value in args.items() if value is not None},
+        }
+        with self._lock:
+            self.events.append(event)
+            self._threads.setdefault((pid, tid), threading.current_thread().name)
+
+    def take(self) -> list[dict]:
+        with self._lock:
+            events = self.events + self._metadata()
+            self.events = []
+            self._threads = {}
+        return events
+
+    def extend(self, events: list[dict]) -> None:
+        with self._lock:
+            self.events.extend(events)
+
+    def _metadata(self) -> list[dict]:
+        return [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for (pid, tid), name in self._threads.items()
+        ]
+
+    def export(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.take(), "displayTimeUnit": "ms"}, f)
+        print(f"Saved profiling trace to {path}.")
+
+
+tracer = Tracer()
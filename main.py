@@ -3,7 +3,9 @@ from core.handlers import FileHandler
 if __name__ == "__main__":
     handler = FileHandler.create()
 
-    if handler.watch:
+    if handler.spool:
+        handler.start_spool()
+    elif handler.watch:
         handler.start_watching()
     else:
         handler.start_processing()
@@ -0,0 +1,4 @@
+import os
+
+# core.cfg requires it; the tests never touch a GPU.
+os.environ.setdefault("GPU_ENABLED", "0")
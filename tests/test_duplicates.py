@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from core.duplicates import BKTree, DuplicateIndex, distance, page_hashes
+
+
+def test_bk_tree_search_returns_keys_within_the_radius():
+    rng = np.random.default_rng(0)
+    keys = [int(key) for key in rng.integers(0, 2**16, 300)]
+    tree = BKTree()
+    for i, key in enumerate(keys):
+        tree.add(key, i)
+
+    for query in [int(key) for key in rng.integers(0, 2**16, 20)] + keys[:5]:
+        for radius in (0, 1, 3, 6):
+            expected = sorted(
+                (distance(query, key), i)
+                for i, key in enumerate(keys)
+                if distance(query, key) <= radius
+            )
+            assert sorted(tree.search(query, radius)) == expected
+
+
+def test_bk_tree_keeps_items_of_equal_keys():
+    tree = BKTree()
+    tree.add(0b1010, "a")
+    tree.add(0b1010, "b")
+    tree.add(0b1011, "c")
+    assert sorted(tree.search(0b1010, 0)) == [(0, "a"), (0, "b")]
+    assert sorted(tree.search(0b1010, 1)) == [(0, "a"), (0, "b"), (1, "c")]
+
+
+def test_empty_bk_tree():
+    assert BKTree().search(1, 64) == []
+
+
+def page(seed):
+    rng = np.random.default_rng(seed)
+    return np.kron(rng.integers(0, 2, (60, 40)) * 255, np.ones((5, 5))).astype(np.uint8)
+
+
+def test_page_hashes_tell_pages_apart():
+    assert page_hashes(page(0), 0.3) == page_hashes(page(0).copy(), 0.3)
+    first, second = page_hashes(page(0), 0.3), page_hashes(page(1), 0.3)
+    assert distance(first[0], second[0]) > 8
+    assert distance(first[1], second[1]) > 8
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DuplicateIndex(str(tmp_path / "duplicates.sqlite3"), 0, 0)
+
+
+def test_index_finds_exact_matches_only(index):
+    index.add([(0b1111, 0b0011, "a.pdf", 1, "NO_WZ", None, True)])
+
+    found = index.find(0b1111, 0b0011)
+    assert found["file"] == "a.pdf"
+    assert (found["page"], found["class"], found["empty"]) == (1, "NO_WZ", True)
+    assert found["distance"] == 0
+    assert index.find(0b1110, 0b0011) is None
+    assert index.find(0b1111, 0b0111) is None
+
+
+def test_index_picks_the_nearest_match_within_both_limits(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.sqlite3"), 2, 1)
+    index.add([
+        (0b0000, 0b0000, "far.pdf", 1, "WZ", "WZ-1", False),
+        (0b0001, 0b0100, "header.pdf", 1, "WZ", "WZ-2", False),
+        (0b0011, 0b0001, "near.pdf", 1, "WZ", "WZ-3", False),
+    ])
+
+    found = index.find(0b0001, 0b0001)
+    assert (found["file"], found["distance"]) == ("near.pdf", 1)
+
+
+def test_index_sees_pages_added_by_other_processes(tmp_path, index):
+    assert index.find(1, 1) is None
+    other = DuplicateIndex(index.path, 0, 0)
+    other.add([(1, 1, "b.pdf", 2, "NO_WZ", None, False)])
+    assert index.find(1, 1)["file"] == "b.pdf"
+
+
+def test_files_links_and_clear(index):
+    index.add_file("digest", "a.pdf", 3)
+    index.add_file("digest", "copy.pdf", 3)
+    assert index.find_file("digest") == {"file": "a.pdf", "pages": 3}
+    assert index.find_file("other") is None
+
+    index.link("copy.pdf", None, {"file": "a.pdf"}, "skipped")
+    (link,) = index.report()
+    assert (link["file"], link["original_file"], link["action"]) == (
+        "copy.pdf",
+        "a.pdf",
+        "skipped",
+    )
+    assert index.stats() == {"pages": 0, "files": 1, "links": 1}
+
+    index.clear()
+    assert index.stats() == {"pages": 0, "files": 0, "links": 0}
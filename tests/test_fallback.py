@@ -0,0 +1,153 @@
+import re
+
+import numpy as np
+import pytest
+
+from core.fallback import EasyOcrFallback, line_box
+from core.models import models
+
+NUMBER = re.compile(r"WZ\W*(\d+/\d+/[A-Z]+/\d{4})")
+
+
+def match(text):
+    return found.group(1) if (found := NUMBER.search(text)) else None
+
+
+class FakeReader:
+    # Returns the same boxes for every header and the text given for a box
+    # and decoder, or for a box under any decoder.
+    def __init__(self, boxes, texts):
+        self.boxes = boxes
+        self.texts = texts
+        self.calls = []
+
+    def detect(self, batch, **params):
+        self.calls.append(("detect", len(batch)))
+        return [self.boxes for _ in batch], [[] for _ in batch]
+
+    def recognize(self, grey, horizontal_list, free_list, decoder, **params):
+        self.calls.append(("recognize", decoder, len(horizontal_list)))
+        results = []
+        for x_min, x_max, y_min, y_max in sorted(
+            horizontal_list, key=lambda box: (box[2], box[0])
+        ):
+            box = (x_min, x_max, y_min, y_max)
+            text = self.texts.get((box, decoder), self.texts.get(box, ""))
+            corners = [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+            results.append((corners, text, 0.9))
+        return results
+
+
+@pytest.fixture
+def reader(monkeypatch):
+    def install(boxes, texts):
+        fake = FakeReader(boxes, texts)
+        monkeypatch.setattr(models, "_reader", fake)
+        return fake
+
+    return install
+
+
+def test_line_box_merges_the_words_after_the_token():
+    token = [10, 50, 10, 30]
+    boxes = [
+        token,
+        [55, 120, 12, 31],
+        [130, 200, 9, 29],
+        # Too far from the previous word.
+        [300, 360, 10, 30],
+        # On the next line, and before the token.
+        [60, 100, 40, 60],
+        [0, 8, 10, 30],
+    ]
+    assert line_box(boxes, token) == [10, 200, 9, 31]
+
+
+def test_line_box_keeps_a_lone_token():
+    token = [10, 50, 10, 30]
+    assert line_box([token, [10, 80, 50, 70]], token) == token
+
+
+def test_only_lines_starting_with_a_token_are_recognized(reader):
+    boxes = [[10, 60, 10, 30], [65, 300, 12, 30], [10, 200, 50, 70]]
+    fake = reader(
+        boxes,
+        {
+            # Starts of the words, read with greedy decoding.
+            (10, 60, 10, 30): "W2-",
+            (65, 125, 12, 30): "12/0",
+            (10, 70, 50, 70): "Data",
+            # The merged line.
+            ((10, 300, 10, 30), "greedy"): "WZ-12/05/ABC/2024",
+        },
+    )
+
+    header = np.zeros((100, 400), np.uint8)
+    assert EasyOcrFallback().run([header], match) == ["12/05/ABC/2024"]
+    assert fake.calls == [
+        ("detect", 1),
+        ("recognize", "greedy", 3),
+        ("recognize", "greedy", 1),
+    ]
+
+
+def test_beam_search_runs_when_greedy_gives_no_number(reader):
+    boxes = [[10, 60, 10, 30], [65, 300, 12, 30]]
+    fake = reader(
+        boxes,
+        {
+            (10, 60, 10, 30): "WZ",
+            ((10, 300, 10, 30), "greedy"): "WZ 1?/O5",
+            ((10, 300, 10, 30), "beamsearch"): "WZ-12/05/ABC/2024",
+        },
+    )
+
+    header = np.zeros((100, 400), np.uint8)
+    assert EasyOcrFallback().run([header], match) == ["12/05/ABC/2024"]
+    assert fake.calls[-1] == ("recognize", "beamsearch", 1)
+
+
+def test_lines_of_all_tokens_are_recognized_together(reader):
+    boxes = [[10, 60, 10, 30], [65, 120, 10, 30], [10, 60, 50, 70]]
+    fake = reader(
+        boxes,
+        {
+            (10, 60, 10, 30): "WZ",
+            (65, 120, 10, 30): "wz",
+            (10, 60, 50, 70): "VV2",
+            ((10, 60, 50, 70), "beamsearch"): "WZ 12/05/ABC/2024",
+        },
+    )
+
+    header = np.zeros((100, 400), np.uint8)
+    assert EasyOcrFallback().run([header], match) == ["12/05/ABC/2024"]
+    assert fake.calls[2:] == [
+        ("recognize", "greedy", 3),
+        ("recognize", "beamsearch", 3),
+    ]
+
+
+def test_headers_without_a_token_are_not_recognized_further(reader):
+    fake = reader([[10, 200, 10, 30]], {(10, 70, 10, 30): "Data"})
+
+    headers = [np.zeros((100, 400), np.uint8), np.zeros((100, 400), np.uint8)]
+    assert EasyOcrFallback().run(headers, match) == [None, None]
+    assert fake.calls == [
+        ("detect", 2),
+        ("recognize", "greedy", 1),
+        ("recognize", "greedy", 1),
+    ]
+
+
+def test_headers_are_detected_in_batches_of_one_size(reader):
+    fake = reader([], {})
+
+    headers = [np.zeros((100, 400), np.uint8) for _ in range(5)]
+    headers.insert(2, np.zeros((120, 400, 3), np.uint8))
+    assert EasyOcrFallback(batch_size=2).run(headers, match) == [None] * 6
+    assert sorted(fake.calls) == [
+        ("detect", 1),
+        ("detect", 1),
+        ("detect", 2),
+        ("detect", 2),
+    ]
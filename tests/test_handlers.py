@@ -0,0 +1,27 @@
+import time
+
+import core.handlers as handlers
+from core.handlers import Watcher
+
+
+def test_stop_leaves_queued_files(monkeypatch):
+    processed = []
+
+    def process_file(file_path, output, options):
+        processed.append(file_path)
+        time.sleep(0.3)
+
+    monkeypatch.setattr(handlers, "process_file", process_file)
+    watcher = Watcher(output="output", workers=1, queue_size=10, ocr_workers=1)
+    for i in range(5):
+        watcher.jobs.put(f"file-{i}.pdf")
+
+    watcher.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    watcher.stop()
+
+    # Only the file being processed is finished.
+    assert processed == ["file-0.pdf"]
+    assert time.monotonic() - started < 1
+    assert watcher.jobs.empty()
@@ -0,0 +1,89 @@
+import json
+
+from core.journal import PageJournal
+
+PARAMS = {"dpi": 200}
+
+
+def journal(tmp_path, digest="abc", params=PARAMS):
+    return PageJournal(str(tmp_path / "file.journal"), digest, params)
+
+
+def test_replays_pages_and_written_groups(tmp_path):
+    first = journal(tmp_path)
+    first.page(1, "WZ", "WZ-1", False)
+    first.page(2, "NO_WZ", None, True)
+    first.write("WZ-1", [1], 1)
+    first.written()
+    first.write("WZ-1", [3], 2)
+    first.written()
+
+    resumed = journal(tmp_path)
+    assert resumed.pages == {1: ("WZ", "WZ-1", False), 2: ("NO_WZ", None, True)}
+    assert resumed.groups == {"WZ-1": [1, 3]}
+    assert resumed.written_pages == {1, 3}
+    assert resumed.pending is None
+
+
+def test_interrupted_write_is_pending(tmp_path):
+    first = journal(tmp_path)
+    first.write("WZ-1", [1, 2], 2)
+
+    resumed = journal(tmp_path)
+    assert resumed.pending == {
+        "type": "write",
+        "wz": "WZ-1",
+        "pages": [1, 2],
+        "total": 2,
+    }
+    assert resumed.groups == {}
+
+    resumed.written()
+    assert journal(tmp_path).groups == {"WZ-1": [1, 2]}
+
+
+def test_forgotten_groups_are_written_again(tmp_path):
+    first = journal(tmp_path)
+    first.write("WZ-1", [1], 1)
+    first.written()
+    first.forget("WZ-1")
+
+    assert journal(tmp_path).groups == {}
+
+
+def test_torn_record_is_dropped(tmp_path):
+    first = journal(tmp_path)
+    first.page(1, "WZ", "WZ-1", False)
+    with open(tmp_path / "file.journal", "a") as f:
+        f.write('{"type": "page", "pa')
+
+    resumed = journal(tmp_path)
+    assert resumed.pages == {1: ("WZ", "WZ-1", False)}
+    with open(tmp_path / "file.journal") as f:
+        assert [json.loads(line)["type"] for line in f] == ["file", "page"]
+
+
+def test_other_file_or_settings_start_over(tmp_path):
+    journal(tmp_path).page(1, "WZ", "WZ-1", False)
+    assert journal(tmp_path, digest="other").pages == {}
+
+    journal(tmp_path).page(1, "WZ", "WZ-1", False)
+    assert journal(tmp_path, params={"dpi": 300}).pages == {}
+
+
+def test_remove(tmp_path):
+    first = journal(tmp_path)
+    first.remove()
+    assert not (tmp_path / "file.journal").exists()
+
+
+def test_skipped_groups_count_as_written_pages(tmp_path):
+    first = journal(tmp_path)
+    first.skip("WZ-1", [1, 2])
+    first.write("WZ-1", [4], 3)
+    first.written()
+
+    resumed = journal(tmp_path)
+    assert resumed.skipped == {"WZ-1": [1, 2]}
+    assert resumed.groups == {"WZ-1": [4]}
+    assert resumed.written_pages == {1, 2, 4}
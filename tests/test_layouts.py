@@ -0,0 +1,62 @@
+import numpy as np
+
+from core.layouts import LayoutStore, fingerprint
+
+
+def store(tmp_path, max_distance=4):
+    return LayoutStore(str(tmp_path / "layouts.sqlite3"), max_distance)
+
+
+def page(seed):
+    rng = np.random.default_rng(seed)
+    return np.kron(rng.integers(0, 2, (40, 30)) * 255, np.ones((10, 10))).astype(
+        np.uint8
+    )
+
+
+def test_fingerprint_ignores_the_body_of_the_page():
+    a, b = page(0), page(0)
+    b[200:] = 255 - b[200:]
+    assert fingerprint(a, 0.3) == fingerprint(b, 0.3)
+    assert fingerprint(a, 0.3) != fingerprint(page(1), 0.3)
+
+
+def test_find_exact_and_nearest(tmp_path):
+    layouts = store(tmp_path)
+    layouts.learn(0b1111_0000, (0.1, 0.2, 0.3, 0.4))
+
+    assert layouts.find(0b1111_0000) == (0b1111_0000, (0.1, 0.2, 0.3, 0.4))
+    assert layouts.find(0b1111_0011) == (0b1111_0000, (0.1, 0.2, 0.3, 0.4))
+    assert layouts.find(0b0000_1111) is None
+
+
+def test_find_in_empty_store(tmp_path):
+    assert store(tmp_path).find(1) is None
+
+
+def test_learn_replaces_the_region_and_persists(tmp_path):
+    layouts = store(tmp_path)
+    layouts.learn(7, (0.0, 0.0, 0.5, 0.5))
+    layouts.learn(7, (0.1, 0.1, 0.6, 0.6))
+
+    reopened = store(tmp_path)
+    assert reopened.find(7) == (7, (0.1, 0.1, 0.6, 0.6))
+
+
+def test_record_counts_hits_and_misses(tmp_path):
+    layouts = store(tmp_path)
+    layouts.learn(7, (0.0, 0.0, 0.5, 0.5))
+    layouts.record(7, hit=True)
+    layouts.record(7, hit=True)
+    layouts.record(7, hit=False)
+
+    (stats,) = layouts.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_clear(tmp_path):
+    layouts = store(tmp_path)
+    layouts.learn(7, (0.0, 0.0, 0.5, 0.5))
+    layouts.clear()
+    assert layouts.find(7) is None
+    assert layouts.stats() == []
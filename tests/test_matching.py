@@ -0,0 +1,70 @@
+import pytest
+
+from core import cfg
+from core.matching import best_match
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ("WZ-12/03/ABC/2024", "WZ-12/03/ABC/2024"),
+        ("W2-I2/O3/ABC/2024", "WZ-12/03/ABC/2024"),
+        ("VVZ-12/03/ABC/2024", "WZ-12/03/ABC/2024"),
+        ("WZ-12 / 03/ABC/2024", "WZ-12/03/ABC/2024"),
+        ("WZ-12/03/abc/2024", "WZ-12/03/ABC/2024"),
+    ],
+)
+def test_accepts_common_confusions(content, expected):
+    wz_nr, confidence = best_match(content)
+    assert wz_nr == expected
+    assert confidence >= cfg.WZ_MATCH_MIN_CONFIDENCE
+
+
+def test_exact_number_is_fully_confident():
+    assert best_match("Dokument WZ-12/03/ABC/2024 z dnia") == (
+        "WZ-12/03/ABC/2024",
+        1.0,
+    )
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "invoice 2024",
+        "WZ-12/03/ABC",
+        "XWZ-12/03/ABC/2024",
+        "WZ-12/03/ABC/20245",
+        "wz-12/03/ABC/2024",
+        "",
+    ],
+)
+def test_rejects_text_without_a_number(content):
+    assert best_match(content) is None
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        # Too many corrections for one number.
+        "WZ-1S/O3/5BC/2O24",
+        "WZ 12 / 03 / abc / 2024",
+        # Implausible month, short year and digits in the supplier code.
+        "WZ-12/13/A8C/24",
+    ],
+)
+def test_rejects_unlikely_numbers(content):
+    _, confidence = best_match(content)
+    assert confidence < cfg.WZ_MATCH_MIN_CONFIDENCE
+
+
+def test_implausible_fields_lower_the_confidence():
+    _, plausible = best_match("WZ-12/03/ABC/2024")
+    _, bad_month = best_match("WZ-12/13/ABC/2024")
+    _, short_year = best_match("WZ-12/03/ABC/24")
+    assert bad_month < plausible
+    assert short_year < plausible
+
+
+def test_picks_the_best_of_several_candidates():
+    wz_nr, confidence = best_match("WZ-2/0l/abc/2024 oraz WZ-1/01/ABC/2024")
+    assert (wz_nr, confidence) == ("WZ-1/01/ABC/2024", 1.0)
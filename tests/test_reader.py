@@ -0,0 +1,251 @@
+import os
+import re
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import core.reader as reader
+from core import cfg
+from core.cache import cache
+from core.duplicates import duplicates
+from core.layouts import layouts
+from core.models import models
+
+# Pages of the test document: text pages, empty pages and WZ pages, by the
+# number Tesseract reads from them ("" for a WZ page it cannot read).
+PAGES = {
+    1: "text",
+    2: "text",
+    3: "WZ-1/01/ABC/2024",
+    4: "text",
+    5: "empty",
+    6: "text",
+    7: "",
+    8: "text",
+    9: "WZ-2/01/ABC/2024",
+    10: "text",
+    11: "text",
+    12: "empty",
+    13: "text",
+    14: "WZ-3/01/ABC/2024",
+}
+# Pages before the first WZ and empty pages are dropped, and a WZ page
+# without a readable number stays in the group before it.
+GROUPS = {
+    "WZ-1/01/ABC/2024": [3, 4, 6, 7, 8],
+    "WZ-2/01/ABC/2024": [9, 10, 11, 13],
+    "WZ-3/01/ABC/2024": [14],
+}
+
+
+def page(page_number: int, variant: int = 0) -> Image.Image:
+    # Every page gets its own pattern, and the page number is kept in the
+    # corner pixel, inside the margin the empty page check skips.
+    array = np.full((200, 160, 3), 255, np.uint8)
+    if PAGES[page_number] != "empty":
+        rng = np.random.default_rng(page_number + 100 * variant)
+        pattern = rng.integers(0, 2, (10, 12), np.uint8) * 255
+        array[60:140, 32:128] = np.kron(pattern, np.ones((8, 8), np.uint8))[..., None]
+    array[0, 0] = page_number
+    return Image.fromarray(array)
+
+
+def page_number(image) -> int:
+    return int(np.asarray(image)[0, 0, 0])
+
+
+class Recognizer:
+    def __init__(self) -> None:
+        self.pages = []
+        self.fail_at = None
+
+    def recognize_batch(self, images, digests=None):
+        numbers = [page_number(image) for image in images]
+        if self.fail_at in numbers:
+            raise RuntimeError("Classifier crashed")
+        self.pages.extend(numbers)
+        return [
+            {
+                "class": "NO_WZ"
+                if PAGES[page_number(image)] in ("text", "empty")
+                else "WZ"
+            }
+            for image in images
+        ]
+
+
+class Reader:
+    def readtext(self, image, **params):
+        return []
+
+    def detect(self, batch, **params):
+        return [[] for _ in batch], [[] for _ in batch]
+
+
+class Document:
+    def __init__(self) -> None:
+        self.recognizer = Recognizer()
+        # Pages rendered differently, as in another scan of the document.
+        self.changed: set[int] = set()
+
+    def convert_from_path(self, path, first_page, last_page, **params):
+        return [
+            page(number, variant=number in self.changed)
+            for number in range(first_page, last_page + 1)
+        ]
+
+    def pdfinfo_from_path(self, path, **params):
+        if not os.path.basename(path).startswith("WZ-"):
+            return {"Pages": len(PAGES)}
+        # Appending to a PDF adds a new page tree after the old one.
+        with open(path, "rb") as f:
+            return {"Pages": int(re.findall(rb"/Count (\d+)", f.read())[-1])}
+
+    def image_to_string(self, image, lang=None, config=None):
+        text = PAGES[page_number(image)]
+        if config is None:
+            # The empty page check reads the whole page.
+            return "" if text == "empty" else "text " * 40
+        return f"WZ {text}" if text.startswith("WZ") else "NOTHING"
+
+
+@pytest.fixture
+def document(tmp_path, monkeypatch):
+    doc = Document()
+    monkeypatch.setattr(reader, "convert_from_path", doc.convert_from_path)
+    monkeypatch.setattr(reader, "pdfinfo_from_path", doc.pdfinfo_from_path)
+    monkeypatch.setattr(reader.pytesseract, "image_to_string", doc.image_to_string)
+    monkeypatch.setattr(models, "_recognizer", doc.recognizer)
+    monkeypatch.setattr(models, "_reader", Reader())
+    monkeypatch.setattr(cache, "enabled", False)
+    monkeypatch.setattr(layouts, "enabled", False)
+    monkeypatch.setattr(cfg, "SPILL_DIR", str(tmp_path))
+    (tmp_path / "document.pdf").write_bytes(b"%PDF")
+    return doc
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = duplicates.path
+    duplicates.relocate(str(tmp_path / "duplicates.sqlite3"))
+    yield duplicates
+    duplicates.relocate(path)
+
+
+def process(
+    tmp_path, name="document.pdf", output="output", **options
+) -> reader.PdfFileProcessor:
+    options = {
+        "text_layer": False,
+        "classify_dpi": 0,
+        "memory_limit": 0,
+        "output_mode": "raster",
+        "bilevel": False,
+        "journal": False,
+        "duplicates": "off",
+        **options,
+    }
+    processor = reader.PdfFileProcessor(
+        str(tmp_path / name), str(tmp_path / output), **options
+    )
+    processor.process_pdf()
+    processor.save_all(move=False)
+    return processor
+
+
+def output_pages(tmp_path, document, output="output") -> dict:
+    return {
+        name: document.pdfinfo_from_path(str(tmp_path / output / name))["Pages"]
+        for name in sorted(os.listdir(tmp_path / output))
+        if name.endswith(".pdf")
+    }
+
+
+def file_name(wz: str) -> str:
+    return f"{wz.replace('/', '_')}.pdf"
+
+
+PAGE_COUNTS = {file_name(wz): len(pages) for wz, pages in GROUPS.items()}
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("window", [0, 1, 4, 5])
+@pytest.mark.parametrize("spill", [False, True])
+def test_pages_are_grouped_by_wz(tmp_path, document, workers, window, spill):
+    processor = process(tmp_path, ocr_workers=workers, page_window=window, spill=spill)
+    assert processor.groups == GROUPS
+    assert output_pages(tmp_path, document) == PAGE_COUNTS
+
+
+@pytest.mark.parametrize("easyocr_batch", [False, True])
+def test_easyocr_fallback_keeps_the_grouping(
+    tmp_path, document, monkeypatch, easyocr_batch
+):
+    monkeypatch.setattr(cfg, "EASYOCR_BATCH", easyocr_batch)
+    assert process(tmp_path, ocr_workers=2, page_window=4).groups == GROUPS
+
+
+@pytest.mark.parametrize("window", [1, 4, 5])
+def test_resumed_file_is_grouped_like_an_uninterrupted_one(tmp_path, document, window):
+    document.recognizer.fail_at = 13
+    with pytest.raises(RuntimeError):
+        process(tmp_path, ocr_workers=1, page_window=window, journal=True)
+
+    document.recognizer.fail_at = None
+    classified = len(document.recognizer.pages)
+    processor = process(tmp_path, ocr_workers=1, page_window=window, journal=True)
+    assert processor.groups == GROUPS
+    assert output_pages(tmp_path, document) == PAGE_COUNTS
+    # Only the pages of the window that crashed are classified again.
+    assert min(document.recognizer.pages[classified:]) > 13 - window
+
+
+def test_rescan_appends_new_pages_to_skipped_groups(tmp_path, document, index):
+    process(tmp_path, ocr_workers=1, page_window=4, duplicates="skip")
+
+    # A rescan with one changed page, processed like a spool worker does.
+    (tmp_path / "rescan.pdf").write_bytes(b"%PDF rescan")
+    document.changed = {13}
+    processor = process(
+        tmp_path,
+        "rescan.pdf",
+        output="staging",
+        final_output_dir=str(tmp_path / "output"),
+        ocr_workers=1,
+        page_window=4,
+        duplicates="skip",
+    )
+    assert processor.groups == {"WZ-2/01/ABC/2024": [13]}
+    assert output_pages(tmp_path, document, "staging") == {
+        file_name("WZ-2/01/ABC/2024"): 5
+    }
+    assert output_pages(tmp_path, document) == PAGE_COUNTS
+
+
+def test_interrupted_append_to_a_skipped_group_is_kept(
+    tmp_path, document, index, monkeypatch
+):
+    process(tmp_path, ocr_workers=1, page_window=4, duplicates="skip")
+    (tmp_path / "rescan.pdf").write_bytes(b"%PDF rescan")
+    document.changed = {13}
+
+    save_pdf = reader.PdfFileProcessor.save_pdf
+
+    def crash(self, file_path, images, append=False):
+        save_pdf(self, file_path, images, append)
+        raise RuntimeError("Crashed after saving")
+
+    # Crashes after the new page was appended, before it was journaled.
+    monkeypatch.setattr(reader.PdfFileProcessor, "save_pdf", crash)
+    options = {"ocr_workers": 1, "page_window": 4, "duplicates": "skip"}
+    with pytest.raises(RuntimeError):
+        process(tmp_path, "rescan.pdf", journal=True, **options)
+
+    monkeypatch.setattr(reader.PdfFileProcessor, "save_pdf", save_pdf)
+    processor = process(tmp_path, "rescan.pdf", journal=True, **options)
+    assert processor.groups["WZ-2/01/ABC/2024"] == [13]
+    assert output_pages(tmp_path, document) == {
+        **PAGE_COUNTS,
+        file_name("WZ-2/01/ABC/2024"): 5,
+    }
@@ -0,0 +1,215 @@
+import json
+import multiprocessing
+import os
+import time
+
+from core.spool import LEASE_SEPARATOR, SpoolWorker
+
+
+class Processed:
+    wz_count = 1
+
+
+class StubWorker(SpoolWorker):
+    # Writes one output per file and logs every run instead of reading PDFs.
+    def run_processor(self, source: str, staging: str) -> Processed:
+        name = self.source_name(os.path.basename(source))
+        if name.startswith("broken"):
+            raise ValueError("broken file")
+        with open(os.path.join(self.output, "runs.log"), "a") as f:
+            f.write(f"{name}\n")
+        time.sleep(0.01)
+        with open(os.path.join(staging, f"{name}.out"), "w") as f:
+            f.write(name)
+        return Processed()
+
+
+def work(path: str, output: str) -> None:
+    StubWorker(path, output, lease_seconds=30, poll_interval=0.05).run()
+
+
+def add_files(path, names, age: float = 60) -> None:
+    for name in names:
+        file_path = os.path.join(path, name)
+        with open(file_path, "w") as f:
+            f.write(name)
+        # Older than WATCHER_STABLE_SECONDS, so the files can be claimed.
+        os.utime(file_path, (time.time() - age, time.time() - age))
+
+
+def outputs(output) -> list[str]:
+    return sorted(name for name in os.listdir(output) if name.endswith(".out"))
+
+
+def done_files(output) -> list[str]:
+    return sorted(
+        name
+        for entry in os.scandir(output)
+        if entry.is_dir()
+        for name in os.listdir(entry.path)
+    )
+
+
+def runs(output) -> list[str]:
+    with open(os.path.join(output, "runs.log")) as f:
+        return sorted(f.read().split())
+
+
+def test_workers_process_each_file_once(tmp_path):
+    path, output = tmp_path / "input", tmp_path / "output"
+    path.mkdir()
+    output.mkdir()
+    names = [f"file-{i:02d}.pdf" for i in range(40)]
+    add_files(path, names)
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=work, args=(str(path), str(output))) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    assert runs(output) == names
+    assert outputs(output) == [f"{name}.out" for name in names]
+    assert done_files(output) == names
+    assert not any(name.endswith(".pdf") for name in os.listdir(path))
+
+
+def test_recover_stale_leases_and_commits(tmp_path):
+    path, output = tmp_path / "input", tmp_path / "output"
+    path.mkdir()
+    output.mkdir()
+    worker = StubWorker(str(path), str(output), lease_seconds=1, poll_interval=0.05)
+
+    # A worker died while holding a lease.
+    lease = os.path.join(worker.leases_dir, f"leased.pdf{LEASE_SEPARATOR}dead-1")
+    add_files(worker.leases_dir, [os.path.basename(lease)])
+
+    # One died after taking the source into staging, before committing.
+    staging = os.path.join(worker.staging_dir, f"staged.pdf{LEASE_SEPARATOR}dead-2")
+    os.makedirs(staging)
+    add_files(staging, ["source.pdf"])
+
+    # And one died halfway through publishing a commit.
+    committing = os.path.join(
+        worker.committing_dir, f"committed.pdf{LEASE_SEPARATOR}dead-3"
+    )
+    os.makedirs(committing)
+    add_files(committing, ["source.pdf", "committed.pdf.out"])
+    with open(os.path.join(committing, "manifest.json"), "w") as f:
+        json.dump(
+            {
+                "outputs": ["committed.pdf.out"],
+                "output_dir": str(output),
+                "done": os.path.join(str(output), "done", "committed.pdf"),
+            },
+            f,
+        )
+    # Leases count as fresh from their last rename, not only their mtime.
+    time.sleep(1.2)
+
+    # A live lease of another worker is left alone.
+    live = os.path.join(worker.leases_dir, f"live.pdf{LEASE_SEPARATOR}alive-4")
+    add_files(worker.leases_dir, [os.path.basename(live)], age=0)
+
+    worker.recover()
+    assert sorted(name for name in os.listdir(path) if name.endswith(".pdf")) == [
+        "leased.pdf",
+        "staged.pdf",
+    ]
+    assert os.path.exists(live)
+    assert os.listdir(worker.committing_dir) == []
+
+    os.remove(live)
+    assert worker.run() == 2
+    assert runs(output) == ["leased.pdf", "staged.pdf"]
+    assert outputs(output) == [
+        "committed.pdf.out",
+        "leased.pdf.out",
+        "staged.pdf.out",
+    ]
+    assert done_files(output) == ["committed.pdf", "leased.pdf", "staged.pdf"]
+
+
+def test_failed_files_are_parked(tmp_path):
+    path, output = tmp_path / "input", tmp_path / "output"
+    path.mkdir()
+    output.mkdir()
+    add_files(path, ["broken.pdf", "good.pdf"])
+
+    worker = StubWorker(str(path), str(output), lease_seconds=5, poll_interval=0.05)
+    assert worker.run() == 1
+    assert os.listdir(worker.failed_dir) == ["broken.pdf"]
+    assert os.listdir(worker.staging_dir) == []
+    assert outputs(output) == ["good.pdf.out"]
+
+
+def abandon_commits(worker: SpoolWorker, output: str, names: list[str]) -> None:
+    for name in names:
+        committing = os.path.join(worker.committing_dir, f"{name}{LEASE_SEPARATOR}dead")
+        os.makedirs(committing)
+        outputs = [f"{name}.{i}.out" for i in range(5)]
+        add_files(committing, ["source.pdf", *outputs])
+        with open(os.path.join(committing, "manifest.json"), "w") as f:
+            json.dump(
+                {
+                    "outputs": outputs,
+                    "output_dir": output,
+                    "done": os.path.join(output, "done", name),
+                },
+                f,
+            )
+
+
+def replay(path: str, output: str, start) -> None:
+    worker = StubWorker(path, output, lease_seconds=1, poll_interval=0.05)
+    start.wait()
+    worker.recover()
+
+
+def test_workers_replay_one_commit_together(tmp_path):
+    path, output = tmp_path / "input", tmp_path / "output"
+    path.mkdir()
+    output.mkdir()
+    worker = StubWorker(str(path), str(output), lease_seconds=30)
+    names = [f"file-{i:02d}.pdf" for i in range(20)]
+    abandon_commits(worker, str(output), names)
+
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    workers = [
+        context.Process(target=replay, args=(str(path), str(output), start))
+        for _ in range(2)
+    ]
+    for process in workers:
+        process.start()
+    # The commits expire a second after they were made.
+    time.sleep(1.5)
+    start.set()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    assert os.listdir(worker.committing_dir) == []
+    assert outputs(output) == sorted(
+        f"{name}.{i}.out" for name in names for i in range(5)
+    )
+    assert done_files(output) == names
+
+
+def test_replaying_a_published_commit(tmp_path):
+    path, output = tmp_path / "input", tmp_path / "output"
+    path.mkdir()
+    output.mkdir()
+    worker = StubWorker(str(path), str(output), lease_seconds=30)
+    abandon_commits(worker, str(output), ["file.pdf"])
+    (committing,) = os.scandir(worker.committing_dir)
+
+    # Another worker published the files and removed the commit meanwhile.
+    assert worker._finish_commit(committing.path)
+    assert not worker._finish_commit(committing.path)
+    assert len(outputs(output)) == 5
+    assert done_files(output) == ["file.pdf"]
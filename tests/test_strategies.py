@@ -0,0 +1,80 @@
+import time
+
+from core.strategies import DEFAULT_ORDER, StrategyEngine
+
+
+def test_untried_steps_keep_the_default_order():
+    assert StrategyEngine().ordered("layout") == list(DEFAULT_ORDER)
+
+
+def test_successful_steps_move_up():
+    engine = StrategyEngine()
+    engine.stats["layout"]["header_psm11_oem3"] = [10, 10]
+    engine.stats["layout"]["page_psm6_oem3"] = [10, 0]
+
+    order = engine.ordered("layout")
+    assert order[0] == "header_psm11_oem3"
+    assert order[-1] == "page_psm6_oem3"
+    # Other layouts keep their own statistics.
+    assert engine.ordered("other") == list(DEFAULT_ORDER)
+
+
+def test_cheaper_steps_move_up():
+    engine = StrategyEngine()
+    for step in DEFAULT_ORDER:
+        engine.seconds[step] = [1, 1.0]
+    engine.seconds["header_psm3_oem3"] = [1, 0.1]
+    assert engine.ordered("layout")[0] == "header_psm3_oem3"
+
+
+def test_fixed_and_deterministic_ignore_statistics():
+    for engine in (StrategyEngine(order="fixed"), StrategyEngine(deterministic=True)):
+        engine.stats["layout"]["easyocr"] = [10, 10]
+        assert engine.ordered("layout") == list(DEFAULT_ORDER)
+
+
+def test_run_stops_at_the_first_match():
+    engine = StrategyEngine(order="fixed")
+    called = []
+
+    def step(name, result):
+        return lambda: called.append(name) or result
+
+    wz_nr, found = engine.run(
+        "layout",
+        {
+            "easyocr": step("easyocr", "WZ-3"),
+            "header_psm6_oem3": step("header_psm6_oem3", "WZ-2"),
+            "page_psm6_oem3": step("page_psm6_oem3", None),
+        },
+    )
+    assert (wz_nr, found) == ("WZ-2", "header_psm6_oem3")
+    assert called == ["page_psm6_oem3", "header_psm6_oem3"]
+    assert engine.stats["layout"]["page_psm6_oem3"] == [1, 0]
+    assert engine.stats["layout"]["header_psm6_oem3"] == [1, 1]
+
+
+def test_run_without_match():
+    engine = StrategyEngine()
+    assert engine.run("layout", {"easyocr": lambda: None}) == (None, None)
+
+
+def test_parallel_deterministic_returns_the_earliest_step():
+    engine = StrategyEngine(parallel=3, deterministic=True)
+
+    def slow():
+        time.sleep(0.05)
+        return "WZ-1"
+
+    wz_nr, found = engine.run(
+        "layout", {"page_psm6_oem3": slow, "header_psm6_oem3": lambda: "WZ-2"}
+    )
+    assert (wz_nr, found) == ("WZ-1", "page_psm6_oem3")
+
+
+def test_parallel_returns_a_match():
+    engine = StrategyEngine(parallel=2)
+    wz_nr, found = engine.run(
+        "layout", {"page_psm6_oem3": lambda: None, "easyocr": lambda: "WZ-2"}
+    )
+    assert (wz_nr, found) == ("WZ-2", "easyocr")